@@ -0,0 +1,156 @@
+"""
+Solves many goals in one process, streaming the answers as JSONL.
+
+    python batch.py goals.jsonl > answers.jsonl
+    python batch.py - --depth 6 --limit 100 --time-lim 10 < goals.jsonl
+    python batch.py --dump-roots > roots.jsonl      # The canonical roots, as goals
+
+Each line of the input is a goal molecule (see `codec.py`), or an object
+{"id": ..., "goal": {...}, "depth": ..., "limit": ..., "time_lim": ...}
+overriding the defaults for that goal. A line {"id": ..., "legit": {...}} makes
+a molecule legit (like the formulas of `roots.setup`), goals can then use it
+as a ready-made part. Each answer is written (and flushed) as
+soon as it is found: {"id": ..., "answer": i, "mole": {...}}, and each goal ends
+with {"id": ..., "done": true, "answers": n, "complete": ..., "time": t,
+"error": ...}, where `complete` is false if the limit or the time ran out (a
+legit line only wants its one answer, so the limit doesn't count for it).
+
+Goals share the engine caches (`glob.legits`, `glob.table`), so what a goal
+has worked out is not worked out again by the next ones. With `--legits DIR`
+the legit molecules are also kept for the next runs, see `legit_store.py`.
+"""
+from kenum import *
+from call_tree import *
+from legit_store import LegitStore
+import codec
+import glob
+import roots
+
+import argparse, json, sys, time
+
+
+LEGIT_DEPTH = 10  # Depth for the legit molecules, as in `roots.setup`
+
+
+class Goal(NamedTuple):
+    id: Any
+    node: Union[Mole, Atom]
+    depth: int
+    limit: Optional[int]
+    time_lim: Optional[float]
+    legit: bool = False  # Only its first answer is wanted, see `parse`
+
+
+def parse(line: str, number: int, depth: int, limit: int = None,
+          time_lim: float = None) -> Goal:
+    """The goal on line `number`, with the defaults given"""
+    data = json.loads(line)
+    if type(data) is dict and 'legit' in data and '_types' not in data:
+        res = Goal(data.get('id', number), codec.decode(data['legit']),
+                   data.get('depth', LEGIT_DEPTH), 1, data.get('time_lim', time_lim), True)
+    elif type(data) is dict and 'goal' in data and '_types' not in data:
+        res = Goal(data.get('id', number), codec.decode(data['goal']),
+                   data.get('depth', depth), data.get('limit', limit),
+                   data.get('time_lim', time_lim))
+    else:
+        res = Goal(number, codec.decode(data), depth, limit, time_lim)
+    if type(res.node) is Mole:
+        types = res.node['_types']
+        if type(types) is not Atom or not types.is_singleton() or only(types) not in grammar().cons:
+            raise ValueError('No such type: {}'.format(types))
+    return res
+
+
+def solve(goal: Goal, orig: LogNode = NULL, deep: bool = False,
+          **options) -> Iterator[Dict[str, Any]]:
+    """
+    The records of `goal`: its answers, then how it went. With `deep`, the
+    depth is raised one at a time up to the goal's (`deepen`). `options` go to
+    the `State` (`cost`, `directed`, `trail`).
+    """
+    search = deepen if deep else kenum
+    deadline = None if goal.time_lim is None else time.time() + goal.time_lim
+    count, error, start = 0, None, time.perf_counter()
+    try:
+        if goal.limit is None or goal.limit > 0:
+            for answer in search(State(node=goal.node, max_dep=goal.depth,
+                                      orig=orig, deadline=deadline, **options)):
+                count += 1
+                yield {'id': goal.id, 'answer': count, 'mole': codec.encode(answer)}
+                if goal.limit is not None and count >= goal.limit: break
+    except KEnumError as e:
+        error = type(e).__name__
+    # Constructors that run out of time are dropped quietly, so check the clock too
+    complete = error is None and (goal.legit or goal.limit is None or count < goal.limit)\
+               and (deadline is None or time.time() < deadline)
+    yield {'id': goal.id, 'done': True, 'answers': count, 'complete': complete,
+           'time': time.perf_counter() - start, 'error': error}
+
+
+def run(lines: Iterable[str], out: TextIO, depth: int, limit: int = None,
+        time_lim: float = None, deep: bool = False, **options) -> int:
+    """Solve the goals of `lines`, returning how many of them failed"""
+    failed = 0
+    for number, line in enumerate(lines, 1):
+        if not line.strip(): continue
+        try:
+            goal = parse(line, number, depth, limit, time_lim)
+        except Exception as e:  # Whatever is wrong with this line, the next ones still run
+            failed += 1
+            _write(out, {'id': number, 'done': True, 'answers': 0, 'complete': False,
+                         'time': 0.0, 'error': 'Bad goal: {}'.format(e)})
+            continue
+        for record in solve(goal, deep=deep, **options):
+            _write(out, record)
+            if record.get('error'): failed += 1
+    return failed
+
+
+def _write(out, record):
+    out.write(json.dumps(record, sort_keys=True) + '\n')
+    out.flush()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Solve goals from a JSONL file, answers as JSONL')
+    parser.add_argument('goals', nargs='?', default='-', help='Goals file (default: stdin)')
+    parser.add_argument('--depth', type=int, default=6, help='Depth cap per goal')
+    parser.add_argument('--limit', type=int, help='Answers per goal')
+    parser.add_argument('--time-lim', type=float, help='Seconds per goal')
+    parser.add_argument('--out', help='Where to write the answers (default: stdout)')
+    parser.add_argument('--best', action='store_true',
+                        help='Best-first search, smallest answers first')
+    parser.add_argument('--deepen', action='store_true',
+                        help='Iterative deepening up to the depth cap, shallowest answers first')
+    parser.add_argument('--directed', action='store_true',
+                        help='Goal-directed search, using the constructors\' goal hooks')
+    parser.add_argument('--trail', action='store_true',
+                        help='Write each constructor\'s molecule in place, undoing on backtracking')
+    parser.add_argument('--legits', help='Directory of a `LegitStore` to use and fill')
+    parser.add_argument('--dump-roots', action='store_true',
+                        help='Write the canonical roots (and their legits) as goals, and stop')
+    args = parser.parse_args(argv)
+    sys.setrecursionlimit(10000)
+    if args.legits: glob.legits = LegitStore(args.legits)
+    if args.best and args.trail: parser.error('--best and --trail cannot go together')
+    options = dict(deep=args.deepen, cost=complexity if args.best else None,
+                   directed=args.directed, trail=args.trail)
+
+    out = sys.stdout if args.out is None else open(args.out, 'w')
+    try:
+        if args.dump_roots:
+            for name, legit in roots.setup().items():
+                _write(out, {'id': name, 'legit': codec.encode(legit)})
+            for name, root in roots.start_roots():
+                _write(out, {'id': name, 'goal': codec.encode(root)})
+            return 0
+        if args.goals == '-':
+            return 1 if run(sys.stdin, out, args.depth, args.limit, args.time_lim, **options) else 0
+        with open(args.goals) as lines:
+            return 1 if run(lines, out, args.depth, args.limit, args.time_lim, **options) else 0
+    finally:
+        if out is not sys.stdout: out.close()
+
+
+if __name__ == '__main__':
+    sys.exit(main())
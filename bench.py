@@ -0,0 +1,144 @@
+"""
+Benchmarks kenum on the canonical roots of `roots.py`.
+
+    python bench.py --out bench.json                  # Run everything
+    python bench.py --roots both --depths 5 6         # Pick roots and depths
+    python bench.py --out new.json --baseline old.json
+
+Every run starts from empty caches (`glob.legits`, `glob.table`) and a new
+table of set values (`bitset.reset`).
+"""
+from kenum import *
+from call_tree import *
+import roots
+import bitset
+import glob
+
+import argparse, json, platform, sys, time, tracemalloc
+
+
+def run(name: str, depth: int, limit: int = None, time_lim: float = None,
+        memory: bool = True) -> Dict[str, Any]:
+    """
+    Enumerate root `name` up to `depth`, stopping after `limit` answers or
+    `time_lim` seconds. Peak memory is measured by a second, traced run, so
+    that tracing doesn't slow down the timed one.
+    """
+    res = {'root': name, 'depth': depth}
+    res.update(_timed(name, depth, limit, time_lim))
+    if memory:
+        _reset()
+        node = dict(roots.start_roots())[name]
+        tracemalloc.start()
+        try:
+            _consume(node, depth, limit, time_lim)
+        finally:
+            res['peak_kb'] = tracemalloc.get_traced_memory()[1] // 1024
+            tracemalloc.stop()
+    return res
+
+
+def _reset():
+    glob.legits.clear()
+    if glob.table is not None: glob.table.clear()
+    bitset.reset()  # Or the values of the earlier runs stay in its table
+
+
+def _state(node, depth, time_lim):
+    deadline = None if time_lim is None else time.time() + time_lim
+    return State(node=node, max_dep=depth, orig=NULL, deadline=deadline)
+
+
+def _consume(node, depth, limit, time_lim):
+    try:
+        for count, _ in enumerate(kenum(_state(node, depth, time_lim)), 1):
+            if limit is not None and count >= limit: break
+    except KEnumError:
+        pass
+
+
+def _timed(name, depth, limit, time_lim):
+    _reset()
+    node = dict(roots.start_roots())[name]
+    glob.stats.reset()  # Not counting the setup
+    count, first, error = 0, None, None
+    start = time.perf_counter()
+    try:
+        for _ in kenum(_state(node, depth, time_lim)):
+            count += 1
+            if first is None: first = time.perf_counter() - start
+            if limit is not None and count >= limit: break
+    except KEnumError as e:
+        error = type(e).__name__
+    elapsed = time.perf_counter() - start
+    return {'answers':  count,
+            'first':    first,
+            'time':     elapsed,
+            'rate':     count / elapsed if elapsed > 0 else None,
+            'complete': error is None and (limit is None or count < limit)
+                        and (time_lim is None or elapsed < time_lim),
+            'error':    error,
+            'stats':    glob.stats.snapshot()}
+
+
+def compare(runs: List[Dict], baseline: List[Dict], tolerance: float) -> List[str]:
+    """
+    The regressions of `runs` against `baseline`: a different number of
+    answers for a complete run, or a run slower by more than `tolerance`.
+    """
+    old = {(r['root'], r['depth']): r for r in baseline}
+    res = []
+    for new in runs:
+        key = (new['root'], new['depth'])
+        if key not in old: continue
+        base = old[key]
+        if new['complete'] and base['complete'] and new['answers'] != base['answers']:
+            res.append('{} depth {}: {} answers, was {}'.format(*key, new['answers'], base['answers']))
+        if new['time'] > base['time'] * (1 + tolerance) and new['time'] - base['time'] > 0.01:
+            res.append('{} depth {}: {:.3f} s, was {:.3f} s'.format(*key, new['time'], base['time']))
+    return res
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Benchmark kenum on the canonical roots')
+    parser.add_argument('--roots', nargs='*', default=list(roots.depths),
+                        help='Names of the roots to run (default: all)')
+    parser.add_argument('--depths', nargs='*', type=int,
+                        help='Depths to run every root at (default: per root)')
+    parser.add_argument('--limit', type=int, default=10000, help='Answers per run')
+    parser.add_argument('--time-lim', type=float, default=60, help='Seconds per run')
+    parser.add_argument('--no-memory', action='store_true', help='Skip the traced run')
+    parser.add_argument('--out', help='Where to write the results (JSON)')
+    parser.add_argument('--baseline', help='Results (JSON) to compare against')
+    parser.add_argument('--tolerance', type=float, default=0.2,
+                        help='Slowdown that counts as a regression (default: 20%%)')
+    args = parser.parse_args(argv)
+    sys.setrecursionlimit(10000)
+
+    runs = []
+    for name in args.roots:
+        for depth in args.depths or roots.depths[name]:
+            r = run(name, depth, args.limit, args.time_lim, not args.no_memory)
+            runs.append(r)
+            print('{:<10} depth {}: {:>6} answers in {:8.3f} s, first after {}, {} KB{}'.format(
+                    name, depth, r['answers'], r['time'],
+                    'none' if r['first'] is None else '{:.4f} s'.format(r['first']),
+                    r.get('peak_kb', '?'), '' if r['complete'] else ' (incomplete)'))
+
+    if args.out:
+        with open(args.out, 'w') as f:
+            json.dump({'python': platform.python_version(),
+                       'date':   time.strftime('%Y-%m-%d %H:%M:%S'),
+                       'runs':   runs}, f, indent=2)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressions = compare(runs, json.load(f)['runs'], args.tolerance)
+        for line in regressions:
+            print('REGRESSION', line)
+        return 1 if regressions else 0
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
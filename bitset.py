@@ -0,0 +1,210 @@
+"""
+Sets as bitmasks over an interned table of values.
+
+Each value put in a `BitSet` gets a small integer once and for all (in this
+process), its bit. Union, intersection, difference and subset tests are then
+integer operations, and so is listing subsets. A `BitSet` is a
+`collections.abc.Set` that equals and hashes like the frozenset of its values,
+so the two mix freely (as atom values, dict keys, set members). Pickles hold
+the values, not the bits.
+
+The table keeps every value it has seen (and so the molecules among them)
+alive, and never shrinks. `reset` starts a new one, e.g. between independent
+runs: the sets made before keep the old table, and are given bits in the new
+one when they meet a newer set, so they stay right. The old table goes away
+with the last of them. Empty sets need no bits, they hold no table at all
+(so defaults like `SetBounds().lower` don't keep the first one).
+"""
+from typing import *
+from collections.abc import Set
+
+
+class _Table:
+    __slots__ = ('values', 'bits')
+
+    def __init__(self):
+        self.values = []  # Bit -> value
+        self.bits = {}    # Value -> bit
+
+
+_table = _Table()
+_NO_TABLE = _Table()  # That of the empty sets, always empty
+
+
+def bit(value) -> int:
+    """The bit of `value` in the current table, given on first use"""
+    res = _table.bits.get(value)
+    if res is None:
+        res = _table.bits[value] = len(_table.values)
+        _table.values.append(value)
+    return res
+
+
+def reset():
+    """Give the values of the sets made from now on new bits, in a new table"""
+    global _table
+    _table = _Table()
+
+
+def is_set(x) -> bool:
+    return type(x) in (set, frozenset, BitSet)
+
+
+class BitSet(Set):
+    __slots__ = ('mask', 'table', '_hash')
+
+    def __init__(self, values: Iterable = ()):
+        if type(values) is BitSet and (values.table is _table or not values.mask):
+            mask = values.mask
+        else:
+            mask = 0
+            for value in values: mask |= 1 << bit(value)
+        self.mask, self.table, self._hash = mask, _table if mask else _NO_TABLE, None
+
+    @classmethod
+    def of_mask(cls, mask: int) -> 'BitSet':
+        """The set of the bits of `mask`, in the current table"""
+        res = cls.__new__(cls)
+        res.mask, res.table, res._hash = mask, _table if mask else _NO_TABLE, None
+        return res
+
+    @classmethod
+    def _from_iterable(cls, it) -> 'BitSet':
+        return cls(it)
+
+    def __contains__(self, value) -> bool:
+        try: b = self.table.bits.get(value)
+        except TypeError: return False  # Unhashable
+        return b is not None and bool(self.mask >> b & 1)
+
+    def __iter__(self) -> Iterator:
+        mask, values = self.mask, self.table.values
+        while mask:
+            low = mask & -mask
+            yield values[low.bit_length() - 1]
+            mask ^= low
+
+    def __len__(self) -> int:
+        return self.mask.bit_count()
+
+    def __hash__(self) -> int:
+        if self._hash is None: self._hash = hash(frozenset(self))
+        return self._hash
+
+    def __reduce__(self):
+        return (BitSet, (list(self),))
+
+    def __repr__(self) -> str:
+        return 'BitSet({{{}}})'.format(', '.join(map(repr, self)))
+
+    # Other sets (and those of an older table) are given bits first, so it all
+    # comes down to masks
+    def __eq__(self, other):
+        self, other = _coerce(self), _coerce(other)
+        return NotImplemented if other is NotImplemented else self.mask == other.mask
+
+    def __ne__(self, other):
+        self, other = _coerce(self), _coerce(other)
+        return NotImplemented if other is NotImplemented else self.mask != other.mask
+
+    def __le__(self, other):
+        self, other = _coerce(self), _coerce(other)
+        return NotImplemented if other is NotImplemented else self.mask & ~other.mask == 0
+
+    def __lt__(self, other):
+        self, other = _coerce(self), _coerce(other)
+        return NotImplemented if other is NotImplemented\
+               else self.mask != other.mask and self.mask & ~other.mask == 0
+
+    def __ge__(self, other):
+        self, other = _coerce(self), _coerce(other)
+        return NotImplemented if other is NotImplemented else other.mask & ~self.mask == 0
+
+    def __gt__(self, other):
+        self, other = _coerce(self), _coerce(other)
+        return NotImplemented if other is NotImplemented\
+               else self.mask != other.mask and other.mask & ~self.mask == 0
+
+    def __and__(self, other):
+        self, other = _coerce(self), _coerce(other)
+        return NotImplemented if other is NotImplemented else BitSet.of_mask(self.mask & other.mask)
+
+    def __or__(self, other):
+        self, other = _coerce(self), _coerce(other)
+        return NotImplemented if other is NotImplemented else BitSet.of_mask(self.mask | other.mask)
+
+    def __sub__(self, other):
+        self, other = _coerce(self), _coerce(other)
+        return NotImplemented if other is NotImplemented else BitSet.of_mask(self.mask & ~other.mask)
+
+    def __rsub__(self, other):
+        self, other = _coerce(self), _coerce(other)
+        return NotImplemented if other is NotImplemented else BitSet.of_mask(other.mask & ~self.mask)
+
+    def __xor__(self, other):
+        self, other = _coerce(self), _coerce(other)
+        return NotImplemented if other is NotImplemented else BitSet.of_mask(self.mask ^ other.mask)
+
+    __rand__, __ror__, __rxor__ = __and__, __or__, __xor__
+
+    def isdisjoint(self, other) -> bool:
+        return BitSet(self).mask & BitSet(other).mask == 0
+
+    # The frozenset methods, taking any iterables
+    def union(self, *others) -> 'BitSet':
+        mask = BitSet(self).mask
+        for other in others: mask |= BitSet(other).mask
+        return BitSet.of_mask(mask)
+
+    def intersection(self, *others) -> 'BitSet':
+        mask = BitSet(self).mask
+        for other in others: mask &= BitSet(other).mask
+        return BitSet.of_mask(mask)
+
+    def difference(self, *others) -> 'BitSet':
+        mask = BitSet(self).mask
+        for other in others: mask &= ~BitSet(other).mask
+        return BitSet.of_mask(mask)
+
+    def issubset(self, other) -> bool:
+        return self <= BitSet(other)
+
+    def issuperset(self, other) -> bool:
+        return self >= BitSet(other)
+
+    def bits(self) -> List[int]:
+        """The single-bit masks of the values, in the current table"""
+        res, mask = [], BitSet(self).mask
+        while mask:
+            low = mask & -mask
+            res.append(low)
+            mask ^= low
+        return res
+
+
+def _coerce(other) -> Union[BitSet, type(NotImplemented)]:
+    if type(other) is BitSet and (other.table is _table or not other.mask): return other
+    elif type(other) in (set, frozenset, BitSet): return BitSet(other)
+    else: return NotImplemented
+
+
+if __name__ == '__main__':
+    import operator, pickle, random
+    rnd, universe = random.Random(0), [0, 1, 2, 'a', 'b', (1, 2), frozenset({3})]
+    some = lambda: frozenset(rnd.sample(universe, rnd.randrange(len(universe) + 1)))
+    for i in range(2000):
+        if i % 500 == 250: reset()  # Sets of an older table still work
+        x, y, z = some(), some(), some()
+        bx, by = BitSet(x), BitSet(y)
+        for op in [operator.and_, operator.or_, operator.sub, operator.xor]:
+            assert op(bx, by) == op(x, y) == op(bx, y) == op(x, by)
+        for op in [operator.eq, operator.ne, operator.le, operator.lt, operator.ge, operator.gt]:
+            assert op(bx, by) == op(x, y) == op(bx, y)
+        assert bx.union(y, z) == x | y | z and bx.intersection(y, z) == x & y & z
+        assert bx.difference(y, z) == x - y - z and bx.isdisjoint(y) == x.isdisjoint(y)
+        assert hash(bx) == hash(x) and len(bx) == len(x) and set(bx) == x
+        assert all((v in bx) == (v in x) for v in universe) and [] not in bx
+        assert BitSet.of_mask(sum(bx.bits())) == x
+        assert pickle.loads(pickle.dumps(bx)) == x
+    assert BitSet().table is _NO_TABLE
+    print('BitSet: ok')
@@ -9,8 +9,10 @@ class LogNode:
         self.choice, self.phase = 0, 0
         self.on = True
 
-    def log(self, msg, level=50):
+    def log(self, msg, *args, level=50):
+        """Log `msg`, formatted with `args` (only if the switch is on)"""
         if self.on:
+            if args: msg = msg.format(*args)
             msg = '[{}]: {}'.format(self.prefix, msg)
             self.logger.log(msg=msg, level=level)
 
@@ -23,8 +25,17 @@ class LogNode:
             msg = '{}\n'.format(str(mole))
             self.logger.log(msg=msg, level=level)
 
+    def mark(self, event, name=None, mole=None):
+        """
+        An event of the search: 'enter' or 'exit' a phase `name`, 'yield' or
+        'prune' `mole`, 'timeout'. The text log says it all already, see
+        `kenum_trace.TraceNode` for the nodes that record these.
+        """
+        pass
+
     def branch(self):
         """Return the a branch from this node"""
+        if not self.on: return NULL
         new_prefix = self.prefix + str(self.choice)
         res = LogNode(prefix=new_prefix, logger=self.logger)
         res.on = self.on
@@ -33,12 +44,28 @@ class LogNode:
 
     def sub(self):
         """Return a subprocess log"""
+        if not self.on: return NULL
         new_prefix = self.prefix + chr(97+self.phase)
         res = LogNode(prefix=new_prefix, logger=self.logger)
         res.on = self.on
         return res
 
 
+class NullLogNode(LogNode):
+    """A switched off node that stays off: logs nothing and branches into itself"""
+    def __init__(self):
+        super().__init__(logger=None)
+        self.on = False
+
+    def log(self, msg, *args, level=50): pass
+    def log_m(self, mole, level=50): pass
+    def branch(self): return self
+    def sub(self): return self
+
+
+NULL = NullLogNode()
+
+
 if __name__ == '__main__':
     # logging.basicConfig(level=logging.DEBUG)
     logging.basicConfig(level=logging.DEBUG, format='%(message)s')
@@ -0,0 +1,107 @@
+"""
+Molecules as JSON.
+
+A molecule is an object of its roles. An atom is a list of its values, or just
+the value if there is only one (and it's a string or a number); implicit atoms
+can only be written by name: {"$atom": "STR"}, or as a set interval (see
+`SetBounds`): {"$bounds": {"lower": [...], "upper": [...], "card": [lo, hi]}}
+("upper" and "hi" may be null). Values are strings, numbers, molecules,
+{"$set": [...]} for a set (read back as a `BitSet`) and {"$tuple": [...]} for
+a tuple.
+
+    {"_types": "PROOF", "dep": [{"$set": [...]}], "formu": {...}}
+"""
+from khoa_math import *
+from khoa_math import _named
+
+from typing import *
+import json
+
+
+def encode(thing: Union[Mole, Atom]):
+    """`thing` as JSON data"""
+    if type(thing) is Mole:
+        return {role: encode(val) for role, val in thing.items()}
+    elif thing.is_explicit():
+        if thing.is_singleton() and _is_scalar(thing[0]): return thing[0]
+        return [_encode_val(val) for val in thing]
+    elif thing.is_bounds():
+        b = thing.qualifier
+        return {'$bounds': {'lower': _encode_val(b.lower)['$set'],
+                            'upper': None if b.upper is None else _encode_val(b.upper)['$set'],
+                            'card': [b.lo, b.hi]}}
+    else:
+        named = _named.get(thing.custom_repr)
+        if named is None or named.qualifier != thing.qualifier:
+            raise ValueError('Cannot encode the anonymous qualifier of {}'.format(thing))
+        return {'$atom': thing.custom_repr}
+
+
+def decode(data) -> Union[Mole, Atom]:
+    """The molecule or atom written as `data`"""
+    if type(data) is dict:
+        if '$atom' in data:
+            named = _named[data['$atom']]
+            return Atom(qualifier=named.qualifier, custom_repr=named.custom_repr)
+        elif '$bounds' in data:
+            b = data['$bounds']
+            return bounded(SetBounds(BitSet(map(_decode_val, b['lower'])),
+                                     None if b['upper'] is None else BitSet(map(_decode_val, b['upper'])),
+                                     *b['card']))
+        return Mole(**{role: decode(val) for role, val in data.items()})
+    elif type(data) is list:
+        return Atom(content=[_decode_val(val) for val in data])
+    else:
+        return wr(data)
+
+
+def dumps(thing: Union[Mole, Atom]) -> str:
+    return json.dumps(encode(thing), sort_keys=True)
+
+
+def loads(text: str) -> Union[Mole, Atom]:
+    return decode(json.loads(text))
+
+
+def _is_scalar(val) -> bool:
+    return val is None or type(val) in (str, int, float, bool)
+
+
+def _encode_val(val):
+    if _is_scalar(val): return val
+    elif type(val) is Mole: return encode(val)
+    elif is_set(val):
+        return {'$set': sorted((_encode_val(v) for v in val),
+                               key=lambda v: json.dumps(v, sort_keys=True))}
+    elif type(val) is tuple: return {'$tuple': [_encode_val(v) for v in val]}
+    else: raise ValueError('Cannot encode this value: {!r}'.format(val))
+
+
+def _decode_val(data):
+    if type(data) is dict:
+        if '$set' in data: return BitSet(map(_decode_val, data['$set']))
+        elif '$tuple' in data: return tuple(map(_decode_val, data['$tuple']))
+        return decode(data).freeze()  # Values are hashed, like the legit formulas they stand for
+    elif type(data) is list:
+        raise ValueError('A value cannot be a list: {}'.format(data))
+    return data
+
+
+if __name__ == '__main__':
+    formu = Mole(_types=wr('WFF'), _text=wr('p')).freeze()
+    thing = Mole(_types=wr('PROOF'), num=wr(3), flags=Atom([True, None, 1.5]),
+                 dep=Atom([BitSet({'a', 'b'}), BitSet(), BitSet({formu})]),
+                 pair=wr(('x', (1, 2))), formu=formu, text=STR, sets=SET, one=SINGLETON,
+                 some=bounded(SetBounds(BitSet({'a'}), BitSet({'a', 'b', 'c'}), 1, 2)),
+                 open=bounded(SetBounds(BitSet({'a'}), None, 2)),
+                 body=Mole(name=Atom(['u', 'v']), deep=Mole(formu=Atom([formu]))))
+    text = dumps(thing)
+    back = loads(text)
+    assert back == thing and dumps(back) == text and back.freeze() is thing.freeze()
+    assert all(type(s) is BitSet for s in back['dep'])
+    assert back['text'].custom_repr == 'STR' and back['some'].is_bounds()
+    assert decode(encode(STR)) == STR and loads(dumps(wr('p'))) == wr('p')
+    for bad in [Atom(qualifier=lambda x: True), Atom([['list']])]:
+        try: dumps(bad); assert False
+        except ValueError: pass
+    print('Codec: ok')
@@ -1 +1,6 @@
+from table import AnswerTable
+from stats import Stats
+
 legits     = set()
+table      = AnswerTable()  # Answers of kenum calls, set to None to disable
+stats      = Stats()        # Counters and timers, see `stats.snapshot()`
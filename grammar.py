@@ -0,0 +1,137 @@
+from khoa_math import *
+from type_data import *
+from rel import *
+import glob
+
+from typing import *
+import hashlib, types
+
+
+class Cons(NamedTuple):  # A compiled constructor
+    form: Mole                                 # Frozen `CI.form`
+    rels: Tuple[Rel, ...]                      # Without the EQ ones, which are `aliases`
+    template: Mole                             # Frozen form, with `_types` and `_cons` set
+    leaf: bool                                 # True if no child is a molecule
+    readers: Dict[str, List[Tuple[Path, Rel]]]  # First role -> [(read path, relation)]
+    goal: Optional[Callable[[Mole], Iterable[Mole]]]  # `CI.goal`
+    aliases: Tuple[Tuple[Path, Path], ...]     # The paths of the EQ relations
+
+
+class Grammar:
+    """
+    What kenum needs to know about `cons_dic`, worked out once:
+    the compiled constructors, the base constructors of each type (those
+    that don't need the type itself) and which types are enumerable at all.
+    """
+    def __init__(self, cons_dic: Dict[str, Dict[str, CI]]):
+        self.version = _version
+        self._cons_dic, self._fingerprint = cons_dic, None
+        self.cons = {type_: {con: _compile(type_, con, ci) for con, ci in cons.items()}
+                     for type_, cons in cons_dic.items()}
+
+        # Least fixpoint: a type is enumerable if one of its base constructors is
+        self.enumerable = {type_: False for type_ in cons_dic}
+        changed = True
+        while changed:
+            changed = False
+            for type_ in cons_dic:
+                if not self.enumerable[type_] and self._base(type_):
+                    self.enumerable[type_], changed = True, True
+        self.base = {type_: self._base(type_) for type_ in cons_dic}
+
+    @property
+    def fingerprint(self) -> str:
+        """See `fingerprint`, worked out on the first use"""
+        if self._fingerprint is None: self._fingerprint = fingerprint(self._cons_dic)
+        return self._fingerprint
+
+    def _base(self, type_: str) -> FrozenSet[str]:
+        def is_base(con: str):
+            for val in self.cons[type_][con].form.values():
+                if type(val) is Mole:
+                    child_type = only(val['_types'])
+                    if child_type == type_ or not self.enumerable.get(child_type, False):
+                        return False
+                elif not val.is_explicit():
+                    return False
+            return True
+        return frozenset(filter(is_base, self.cons[type_]))
+
+
+def _compile(type_: str, con: str, ci: CI) -> Cons:
+    form = ci.form.freeze()
+    template = (Mole(_types=wr(type_), _cons=wr(con)) & form).freeze()
+    leaf = not any(type(val) is Mole for val in form.values())
+    rels = tuple(rel for rel in ci.rels if rel.type != 'EQ')
+    aliases = tuple((rel['left'], rel['right']) for rel in ci.rels if rel.type == 'EQ')
+    return Cons(form, rels, template, leaf, rel_index(rels), ci.goal, aliases)
+
+
+def rel_index(rels: Iterable[Rel]) -> Dict[str, List[Tuple[Path, Rel]]]:
+    """Index relations by the first role of the paths they read"""
+    readers = {}
+    for rel in rels:
+        for path in rel.reads():
+            readers.setdefault(path[0], []).append((path, rel))
+    return readers
+
+
+def fingerprint(cons_dic) -> str:
+    """
+    A digest of `cons_dic` that is the same from one process to the next: the
+    forms, and the relations down to the code of their functions.
+    """
+    return hashlib.sha1(_digest(cons_dic).encode()).hexdigest()
+
+
+def _digest(thing) -> str:
+    if type(thing) is dict:
+        return '{' + ','.join('{}:{}'.format(k, _digest(thing[k])) for k in sorted(thing)) + '}'
+    elif type(thing) is Mole:
+        return 'M' + _digest(dict(thing))
+    elif type(thing) is Atom:
+        if thing.is_explicit(): return 'A' + _digest(frozenset(thing))
+        return 'Q' + _digest(thing.qualifier)
+    elif type(thing) is Rel:
+        return 'R' + thing.type + _digest(dict(thing))
+    elif type(thing) is CI:
+        return 'C' + _digest(thing.form) + _digest(list(thing.rels)) + _digest(thing.goal)
+    elif is_set(thing):
+        return 'S(' + ','.join(sorted(map(_digest, thing))) + ')'
+    elif type(thing) in (list, tuple):
+        return '(' + ','.join(map(_digest, thing)) + ')'
+    elif type(thing) is Opaque:
+        return 'O' + _digest(thing.fun)
+    elif type(thing) in (Tag, Not):
+        return repr(thing)
+    elif type(thing) is And:
+        return '&' + _digest(thing.preds)
+    elif type(thing) is types.FunctionType:
+        cells = [c.cell_contents for c in thing.__closure__ or ()]
+        return 'F' + _digest(thing.__code__) + _digest(cells)
+    elif type(thing) is types.CodeType:
+        return thing.co_code.hex() + repr(thing.co_names) + _digest(thing.co_consts)
+    else:
+        return repr(thing)
+
+
+_compiled, _version = None, 0
+
+def grammar() -> Grammar:
+    """
+    The compiled `cons_dic`, compiled again after a `reset`. Answers recorded
+    under the old grammar are dropped then.
+    """
+    global _compiled
+    if _compiled is None or _compiled.version != _version:
+        if _compiled is not None:
+            glob.legits.clear()
+            if glob.table is not None: glob.table.clear()
+        _compiled = Grammar(cons_dic)
+    return _compiled
+
+
+def reset():
+    """Call it after adding, removing or replacing a constructor in `cons_dic`"""
+    global _version
+    _version += 1
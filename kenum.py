@@ -2,12 +2,13 @@ from misc import *
 from khoa_math import *
 from type_data import *
 from rel import *
+from grammar import *
 from call_tree import *
 import glob
 
 import anytree
 from typing import *
-from itertools import product, starmap
+from itertools import starmap
 
 from functools import partial, reduce
 import time
@@ -17,12 +18,19 @@ class KEnumError(Exception):
     pass
 class InfinityError(KEnumError):
     def __init__(self, node):
-        self.message = 'Cannot enumerate this node: {}'.format(node)
+        glob.stats.count('InfinityError')
         self.node = node
+    @property
+    def message(self):
+        return 'Cannot enumerate this node: {}'.format(self.node)
 class OutOfTimeError(KEnumError):
+    transient = True  # Depends on the deadline, so it is not tabled
     def __init__(self, node):
-        self.message = 'Out of time while enumerating this node'.format(node)
+        glob.stats.count('OutOfTimeError')
         self.node = node
+    @property
+    def message(self):
+        return 'Out of time while enumerating this node: {}'.format(self.node)
 
 
 class State:
@@ -32,14 +40,31 @@ class State:
                  orig: LogNode,
                  deadline: float = None,
                  time_lim: float = None,
-                 got_timeout: float = False):
-        self.node, self.max_dep, self.orig, self.deadline, self.time_lim, self.got_timeout\
-        = node, max_dep, orig, deadline, time_lim, got_timeout
+                 weights: Dict[str, int] = None,
+                 cost: Callable[[Mole], float] = None,
+                 directed: bool = False,
+                 trail: bool = False):
+        """
+        `deadline` is absolute, `time_lim` is an optional budget for each
+        constructor and relation, for the time it runs (see `Clock`). `weights` maps constructors to the number of
+        answers they get per turn of the scheduler (1 by default).
+        With a `cost` (e.g. `complexity`), the search is best-first instead,
+        answers come cheapest first. `directed` turns on the `goal` hooks of
+        the constructors (see `CI`). With `trail`, each constructor works on a
+        single molecule written in place and undone on backtracking (see
+        `Mole.trailed`), so its partial molecules are not interleaved.
+        """
+        assert not (trail and cost), 'Best-first search needs the partial molecules side by side'
+        self.node, self.max_dep, self.orig, self.deadline, self.time_lim, self.weights, self.cost\
+        = node, max_dep, orig, deadline, time_lim, weights, cost
+        self.directed, self.trail = directed, trail
+        self.clock = None  # The budget of the innermost constructor or relation
 
     def clone(self, **kwargs):
         """Offer a shallow copy with custom modification"""
         res = State(self.node, self.max_dep, self.orig, self.deadline,
-                    self.time_lim, self.got_timeout)
+                    self.time_lim, self.weights, self.cost, self.directed, self.trail)
+        res.clock = self.clock
         for k in kwargs:
             setattr(res, k, kwargs[k])
         return res
@@ -54,66 +79,128 @@ def check_time(original_function):
         s = args[0]; assert type(s) is State
         if s.deadline is not None:
             if time.time() > s.deadline:
-                s.orig.log('We\'re late by: {} s'.format(time.time()-s.deadline))
+                s.orig.log('We\'re late by: {} s', time.time()-s.deadline)
+                s.orig.mark('timeout')
                 raise OutOfTimeError(s.node)
-            else:
-                s.orig.log('Time until deadline: {}'.format(s.deadline-time.time()))
+            elif s.orig.on:
+                s.orig.log('Time until deadline: {}', s.deadline-time.time())
+        if s.clock is not None and s.clock.over():
+            s.orig.log('Out of budget'); s.orig.mark('timeout')
+            raise OutOfTimeError(s.node)
         return original_function(*args,**kwargs)
     return new_function
 
 
-def time_man(orig_fun):
-    """Decorator: Time Manager"""
-    def new_fun(*args, **kwargs):
-        INIT_TIME_LIM = 0.01
-        COEF = 10  # To multiply the previous time limit
-        s = args[0]
-        while True:
-            s.time_lim = INIT_TIME_LIM if s.time_lim is None else COEF*s.time_lim
-            for res in orig_fun(*args, **kwargs):
+class Clock:
+    """
+    A budget of `seconds` that only runs while its generator does (see `run`),
+    so that under `interleave` the time of the other branches doesn't count.
+    It's over when the enclosing budget is, too.
+    """
+    def __init__(self, seconds: float, outer: Optional['Clock'] = None):
+        self.left, self.outer, self.since = seconds, outer, None
+
+    def start(self):
+        if self.since is None: self.since = time.time()
+
+    def stop(self):
+        if self.since is not None:
+            self.left -= time.time() - self.since
+            self.since = None
+
+    def over(self) -> bool:
+        return self.since is not None and time.time() - self.since > self.left\
+               or self.outer is not None and self.outer.over()
+
+    def run(self, gen: Iterator) -> Iterator:
+        """`gen`, with the clock running while it does"""
+        self.start()
+        try:
+            for res in gen:
+                self.stop()
                 yield res
-            if not s.got_timeout:
-                break
-            else:
-                s.got_timeout = False
-    return new_fun
+                self.start()
+        finally:
+            self.stop()
+
+
+def budgeted(s: State, phase: Callable, *args) -> Iterator:
+    """`phase(s, *args)`, within a budget of `s.time_lim` if there is one"""
+    if s.time_lim is None: return phase(s, *args)
+    s = s.clone(); s.clock = Clock(s.time_lim, s.clock)
+    return s.clock.run(phase(s, *args))
 
 
 def is_enumerable(mole):
     """Return False if the molecule is surely unenumerable given any depth"""
-    def can_enumerate_type(type_: str):
-        def is_base_constructor(con: str):
-            res = True
-            form = cons_dic[type_][con].form
-            for val in form.values():
-                if type(val) is Mole:
-                    this_type = only(val['_types'])
-                    if this_type == type_ or (not can_enumerate_type(this_type)):
-                        res = False; break
-                elif not val.is_explicit():
-                    res = False; break
-            return res
-
-        all_constructors = cons_dic[type_].keys()
-        return any(map(is_base_constructor, all_constructors))
-
     if any(map(lambda k: k not in ['_types', '_cons'], mole.keys())):
         return True
     else:
-        return can_enumerate_type(only(mole['_types']))
+        return grammar().enumerable[only(mole['_types'])]
 
 
-@check_time
-@time_man
 def kenum(s: State):
-    s.orig.log(30*'#'); s.orig.log('Welcome to kenum!')
+    """
+    Enumerate all legit values of `s.node`.
+    Molecules are tabled in `glob.table` by (node, depth), so a sub-goal that
+    is reached again replays the recorded answers instead of starting over.
+    Best-first and directed calls are tabled apart (see `family`). A call that
+    completed without hitting the depth cap is reused at any larger depth.
+    """
+    if type(s.node) is Mole: s.node = s.node.freeze()  # The caller may write into its own in place
+    if type(s.node) is Atom or glob.table is None:
+        return _kenum(s)
+    glob.stats.tick()
+    if s.node in glob.legits:  # Whatever the depth, and even if it wasn't when the entry was made
+        glob.stats.count('legit_hit')
+        return iter((s.node,))
+    fam = family(s)
+    settled = glob.table.settled.get(fam)
+    if settled is not None and settled[0] <= s.max_dep:
+        glob.stats.count('settled_hit')
+        return glob.table.consume(settled[1], None)
+    return glob.table.consume((fam, s.max_dep), lambda: _kenum(s), (fam, s.max_dep))
+
+
+def family(s: State) -> Hashable:
+    """The frozen node, with the options that change the answers or their order"""
+    if s.cost is None and not s.directed: return s.node
+    return (s.node, s.cost, s.directed)
+
+
+def deepen(s: State, start: int = 1):
+    """
+    Iterative deepening: `kenum` at depth `start`, then one more each pass, up
+    to `s.max_dep` (None for no cap), and each answer only the first time. So
+    answers come by the depth they need. The passes share `glob.table`: a
+    sub-goal that never hit the depth cap is not enumerated again deeper, and
+    once the goal itself didn't, there's nothing left to find.
+    """
+    seen = set()
+    for depth in (count(start) if s.max_dep is None else range(start, s.max_dep + 1)):
+        s.orig.log('Deepening to {}', depth)
+        for answer in kenum(s.clone(max_dep=depth, orig=s.orig.sub())):
+            if answer not in seen:
+                seen.add(answer)
+                yield answer
+        if type(s.node) is Atom or glob.table is not None and\
+                family(s.clone(node=s.node.freeze())) in glob.table.settled:
+            s.orig.log('Nothing was cut at depth {}, done', depth)
+            return
+
+
+@check_time
+def _kenum(s: State):
+    s.orig.log(30*'#'); s.orig.log('Welcome to kenum!'); s.orig.mark('enter', 'kenum', s.node)
     s.orig.log('The node is:'); s.orig.log_m(s.node)
     if type(s.node) == Atom:
         s.orig.log('It\'s an atom')
-        if s.node.is_explicit():
-            for val in s.node:
-                s.orig.log('Yielding this value: {}'.format(wr(val)))
-                yield wr(val)
+        if s.node.is_finite():
+            for val in (s.node if s.node.is_explicit() else s.node.qualifier.sets()):
+                val = wr(val)
+                s.orig.log('Yielding this value: {}', val)
+                yield val
+            s.orig.mark('exit', 'kenum')
         else:
             s.orig.log('Can\'t get any value for it')
             raise InfinityError(s.node)
@@ -126,137 +213,283 @@ def kenum(s: State):
             raise InfinityError(s.node)
         else: s.orig.log('There is a hope for enumeration')
 
-        if s.node in glob.legits:
-            s.orig.log('Molecule already legit, yielding!')
-            yield s.node
+        node = s.node.freeze()
+        if node in glob.legits:
+            glob.stats.count('legit_hit')
+            s.orig.log('Molecule already legit, yielding!'); s.orig.mark('yield', mole=node)
+            yield node
+            s.orig.mark('exit', 'kenum')
             return
+        glob.stats.count('legit_miss')
 
         s.orig.log('Let\'s go to Formation Phase')
-        for well_formed in form_p(s.clone(orig=s.orig.sub())):
-            try:
-                s.deadline = time.time() + s.time_lim
-                this_wf_orig = s.orig.branch()
-                this_wf_orig.log('Chosen this from Formation phase')
-                this_wf_orig.log_m(well_formed)
-                this_wf_orig.log('Let\'s go to Relation Phase')
-
-                rels = cons_dic[only(well_formed['_types'])][only(well_formed['_cons'])].rels
-                for partial_ in cycle_rel_p(s.clone(node=well_formed, orig=this_wf_orig.sub()), rels):
-                    this_rel_orig = this_wf_orig.branch()
-                    this_rel_orig.log('Chosen this from Relation Phase:')
-                    this_rel_orig.log_m(partial_)
-                    this_rel_orig.log('Let\'s go to Finishing Phase')
-
-                    for finished in fin_p(s.clone(node=partial_, orig=this_rel_orig.sub())):
-                        this_fin_orig = this_rel_orig.branch()
-                        this_fin_orig.log('Chosen this from Finishing Phase:')
-                        this_fin_orig.log_m(finished)
-                        glob.legits.add(finished)
-                        this_fin_orig.log('All phases are complete, yielding from kenum')
-                        yield finished
-            except OutOfTimeError:
-                this_wf_orig.log('So we ran out of time on this constructor')
-                s.got_timeout = True
+        wfs = list(glob.stats.timed('form_p', form_p(s.clone(orig=s.orig.sub()))))
+        if s.cost is not None:
+            s.orig.log('Merging {} constructors, cheapest first', len(wfs))
+            answers = best_merge(((s.cost(wf), glob.stats.timed((only(wf['_types']), only(wf['_cons'])),
+                                                                cons_p(s.clone(), wf)))
+                                  for wf in sorted(wfs, key=s.cost)), s.cost)
+        else:
+            weights = [s.weights.get(only(wf['_cons']), 1) for wf in wfs] if s.weights else ()
+            s.orig.log('Interleaving {} constructors', len(wfs))
+            answers = interleave((glob.stats.timed((only(wf['_types']), only(wf['_cons'])),
+                                                   cons_p(s.clone(), wf))
+                                  for wf in wfs), weights)
+        for finished in answers:
+            yield finished
+        s.orig.mark('exit', 'kenum')
+
+
+def cons_p(s: State, well_formed: Mole):
+    """Relation and Finishing phases for the well-formed node of one constructor"""
+    return budgeted(s, _cons_p, well_formed)
+
+
+def _cons_p(s: State, well_formed: Mole):
+    try:
+        this_wf_orig = s.orig.branch()
+        this_wf_orig.log('Chosen this from Formation phase')
+        this_wf_orig.log_m(well_formed)
+        this_wf_orig.log('Let\'s go to Relation Phase')
+
+        def finish(partial_):
+            this_rel_orig = this_wf_orig.branch()
+            this_rel_orig.log('Chosen this from Relation Phase:')
+            this_rel_orig.log_m(partial_)
+            this_rel_orig.log('Let\'s go to Finishing Phase')
+
+            for finished in glob.stats.timed('fin_p', fin_p(s.clone(node=partial_, orig=this_rel_orig.sub()))):
+                this_fin_orig = this_rel_orig.branch()
+                this_fin_orig.log('Chosen this from Finishing Phase:')
+                this_fin_orig.log_m(finished)
+                finished = finished.freeze()
+                glob.legits.add(finished)
+                this_fin_orig.log('All phases are complete, yielding from kenum')
+                this_fin_orig.mark('yield', mole=finished)
+                yield finished
+
+        compiled = grammar().cons[only(well_formed['_types'])][only(well_formed['_cons'])]
+        well_formed = with_aliases(well_formed, compiled.aliases)  # Lost if it was frozen or sent as is
+        if s.trail: well_formed = well_formed.clone().trailed()
+        partials = glob.stats.timed('prop_p', prop_p(s.clone(node=well_formed, orig=this_wf_orig.sub()),
+                                                     compiled.rels, compiled.readers))
+        if s.trail: finisheds = (finished for p in partials for finished in finish(p))
+        elif s.cost is None: finisheds = interleave(map(finish, partials))
+        else: finisheds = best_merge(((s.cost(p), finish(p)) for p in partials), s.cost)
+        for finished in finisheds:
+            yield finished
+    except OutOfTimeError:
+        this_wf_orig.log('So we ran out of time on this constructor')
+        this_wf_orig.mark('timeout')
+        if glob.table is not None: glob.table.timeout()  # Not complete, whatever happens next
+
+
+def complexity(mole: Mole) -> int:
+    """
+    The usual cost for best-first search: the number of molecules. A cost must
+    not decrease as a molecule gets filled in, and answers come exactly
+    cheapest first if it adds up over the children, like this one.
+    """
+    return mole.complexity
+
+
+def _state_product(s: State, *iterables):
+    """`dprod`, or `cprod` by the cost of the molecules for best-first search"""
+    if s.cost is None: return dprod(*iterables)
+    return cprod(*iterables, cost=lambda x: s.cost(x) if type(x) is Mole else 0)
 
 
 def form_p(s: State):
     """Assure that the s.node is well-formed"""
-    s.orig.log('#'*30); s.orig.log('Welcome to Formation Phase')
+    s.orig.log('#'*30); s.orig.log('Welcome to Formation Phase'); s.orig.mark('enter', 'form_p', s.node)
     assert(s.node['_types'].is_singleton()), 'How come the type is unknown?'
     s.node_type = only(s.node['_types'])
-    cons = s.node['_cons'] & Atom(cons_dic[only(s.node['_types'])].keys())
-    s.orig.log('Current constructor is: {}'.format(s.node['_cons']))
-    s.orig.log('Possible constructors after unified are: {}'.format(cons))
+    compiled = grammar().cons[s.node_type]
+    cons = s.node['_cons'] & Atom(compiled.keys())
+    bare = s.node.keys() <= {'_types', '_cons'}  # Then the template is the answer
+    s.orig.log('Current constructor is: {}', s.node['_cons'])
+    s.orig.log('Possible constructors after unified are: {}', cons)
     s.orig.log('Exploring all constructors')
     for con in cons:
-        con_orig = s.orig.branch(); con_orig.log('Chosen constructor {}'.format(con))
-        form, rels = cons_dic[only(s.node['_types'])][con]
+        con_orig = s.orig.branch(); con_orig.log('Chosen constructor {}', con)
+        form, template = compiled[con].form, compiled[con].template
 
-        if s.max_dep == 1 and any(map(lambda x: type(x) is Mole, form.values())):
+        if s.max_dep == 1 and not compiled[con].leaf:
             con_orig.log('Out of depth, try another constructor')
+            if glob.table is not None: glob.table.cutoff()
             continue
         else:
-            con_orig.log('Depth remaining: {}'.format(s.max_dep))
+            con_orig.log('Depth remaining: {}', s.max_dep)
 
-        res = s.node.clone()
-        res['_cons'] = wr(con)
-        res &= form
+        if bare: res = template
+        else: res = s.node & template; glob.stats.count('unify')
+        res = with_aliases(res, compiled[con].aliases)
         con_orig.log('Attached all components')
         con_orig.log_m(res)
-        if not res.is_inconsistent():
+        if res.is_inconsistent():
+            con_orig.log('Inconsistent'); con_orig.mark('prune', mole=res)
+            glob.stats.count('prune')
+        elif s.directed and compiled[con].goal is not None:
+            con_orig.log('Consistent, narrowing it down to the goal')
+            for narrowed in compiled[con].goal(res):
+                con_orig.log('Yielding from formation phase:'); con_orig.log_m(narrowed)
+                yield narrowed
+        else:
             con_orig.log('Consistent, yielding from formation phase')
             yield res
-        else: con_orig.log('Inconsistent')
+    s.orig.mark('exit', 'form_p')
 
 
-@check_time
-@time_man
-def cycle_rel_p(s: State, rels):
-    for new_node, unchecked_rels in repeat_rel_p(
-            s, iter(rels)):
-        new_orig = s.orig.branch()
-        new_orig.log('Chosen from `repeat_rel_p`:'); new_orig.log_m(new_node)
-        if new_node == s.node:
-            new_orig.log('`repeat_rel_p` didn\'t do anything')
-            if unchecked_rels:
-                new_orig.log('There are unchecked relations, which is bad')
-                raise InfinityError(s.node)
-            else:
-                new_orig.log('All relations checked! Yielding:'); new_orig.log_m(s.node)
-                yield s.node
-        else:
-            new_orig.log('Got new information!')
-            if unchecked_rels:
-                new_orig.log('Still got some relations, going to the next cycle')
-                for res in cycle_rel_p(s.clone(node=new_node, orig=new_orig), unchecked_rels):
-                    yield res
-            else:
-                new_orig.log('No more relations left, yielding this:'); new_orig.log_m(new_node)
-                yield new_node
+def with_aliases(node: Mole, aliases) -> Mole:
+    """`node` with its paths aliased as in `aliases` (see `Cons.aliases`), cloned first if frozen"""
+    if all(any(left in c and right in c for c in node._aliases) for left, right in aliases):
+        return node  # Already (or nothing to do)
+    res = node.clone() if node._frozen else node
+    for left, right in aliases: res.alias(left, right)
+    return res
 
 
 @check_time
-def repeat_rel_p(s: State, rel_iter):
-    try:
-        this_rel = next(rel_iter)
-    except StopIteration:
-        s.orig.log('No more relations left, yielding')
-        yield (s.node, ())
-        return
-    try:
-        new_deadline = time.time() + s.time_lim
-        for new_node in rel_p(s.clone(deadline=new_deadline), this_rel):
-            choice_orig = s.orig.branch()
-            choice_orig.log('Chosen '); choice_orig.log_m(new_node)
-            choice_orig.log('Moving on to the next relation')
-            rel_iter, new_rel_iter = tee(rel_iter)  # New path, new iterator
-            for res, unchecked_rels in repeat_rel_p(
-                    s.clone(node=new_node, orig=choice_orig), new_rel_iter):
-                yield (res, unchecked_rels)
-    except KEnumError as e:
-        if type(e) is OutOfTimeError:
-            s.orig.log('We ran out of time for this relation')
-            s.got_timeout = True
-        elif type(e) is InfinityError:
+def prop_p(s: State, rels, readers=None):
+    """
+    Relation Phase, as constraint propagation over a worklist of relations.
+    Relations whose inputs are all known cannot branch, they are fired first,
+    up to a fixpoint. Then we branch on the first relation that's left.
+    A relation is fired again only when a path it reads has just changed, and
+    relations that cannot be applied yet wait for the same thing.
+    `readers` is `rel_index(rels)`, if it's at hand.
+    """
+    if readers is None: readers = rel_index(rels)
+    s.orig.mark('enter', 'prop_p', s.node)
+    for res in _propagate(s, readers, list(rels), []):
+        yield res
+    s.orig.mark('exit', 'prop_p')
+
+
+def _propagate(s: State, readers, agenda, parked):
+    node, agenda, parked, branching = s.node, list(agenda), list(parked), []
+    while agenda:
+        rel = agenda.pop(0)
+        if not is_ground(node, rel):
+            branching.append(rel)
+            continue
+        s.orig.log('Firing relation {}', rel)
+        before, mark = _values(node, rel), node.mark()
+        try:
+            # Known inputs make for one result at most, and a trailed node keeps it
+            result = next(iter(budgeted(s.clone(node=node, orig=s.orig.sub()), rel_p, rel)), None)
+        except OutOfTimeError:
+            raise  # Not the relation's fault, nor the node's
+        except KEnumError:
+            s.orig.log('Cannot apply this relation (right now)')
+            node.undo(mark)
+            parked.append(rel)
+            continue
+        if result is None:
+            glob.stats.count('prune')
+            s.orig.log('Inconsistent, dropping this branch'); s.orig.mark('prune', mole=node)
+            return
+        for woken in _woken(readers, rel, before, result):
+            for waiting in [parked, branching]:
+                if woken in waiting: waiting.remove(woken)
+            if woken not in agenda: agenda.append(woken)
+        node = result
+
+    s.orig.log('Reached a fixpoint:'); s.orig.log_m(node)
+    branching.sort(key=lambda rel: not is_finite(node, rel))
+    for i, rel in enumerate(branching):
+        s.orig.log('Branching on relation {}', rel)
+        rest, mark = branching[:i] + branching[i+1:], node.mark()
+        try:
+            choices = _choices(s.clone(node=node), readers, rel, rest, parked)
+            if s.cost is None: results = (res for _, stream in choices for res in stream)
+            else: results = best_merge(((s.cost(new), stream) for new, stream in choices), s.cost)
+            for res in results:
+                yield res
+            return
+        except OutOfTimeError:
+            raise
+        except KEnumError:
             s.orig.log('Cannot apply this relation (right now)')
-        s.orig.log('Moving on to the next relation anyways')
-        for res, unchecked_rels in repeat_rel_p(s, rel_iter):
-            yield (res, (this_rel,)+unchecked_rels)
+            node.undo(mark)
+            parked.append(rel)
+
+    if parked:
+        s.orig.log('There are relations that can never be applied, which is bad')
+        raise InfinityError(node)
+    else:
+        s.orig.log('All relations checked! Yielding:'); s.orig.log_m(node)
+        s.orig.mark('yield', mole=node)
+        yield node
+
+
+def _choices(s: State, readers, rel: Rel, rest, parked):
+    """The nodes `rel` branches `s.node` into, each with the propagation that follows"""
+    before = _values(s.node, rel)
+    for new_node in budgeted(s.clone(orig=s.orig.sub()), rel_p, rel):
+        choice_orig = s.orig.branch()
+        choice_orig.log('Chosen '); choice_orig.log_m(new_node)
+        woken = _woken(readers, rel, before, new_node)
+        yield new_node, _propagate(s.clone(node=new_node, orig=choice_orig), readers,
+                                   rest + [r for r in woken if r not in rest],
+                                   [r for r in parked if r not in woken])
+
+
+def is_ground(node: Mole, rel: Rel) -> bool:
+    """True if all inputs of `rel` are known, so that it cannot branch"""
+    for path in (rel['inp'] if rel.type == 'FUN' else rel['subs']):
+        val = node[path[0]]
+        if type(val) is Atom:
+            if not val.is_singleton(): return False
+        elif type(val) is Mole:
+            if val.freeze() not in glob.legits: return False
+        else: return False
+    return True
+
+
+def is_finite(node: Mole, rel: Rel) -> bool:
+    """True if all inputs of `rel` are finite atoms, so that it branches on a known list"""
+    return all(type(node[path[0]]) is Atom and node[path[0]].is_finite()
+               for path in (rel['inp'] if rel.type == 'FUN' else rel['subs']))
+
+
+def _values(node: Mole, rel: Rel) -> Dict[Path, Any]:
+    """
+    The values `rel` may change in `node` (and their aliases), to tell what
+    it did change. A trailed node is changed in place, so its molecules are
+    copied (frozen).
+    """
+    paths = [p for w in rel.writes() for p in [w, *node.aliased(w)]]
+    if node.mark() is None: return {p: node.at(p) for p in paths}
+    return {p: node.at(p).freeze() if type(node.at(p)) is Mole else node.at(p) for p in paths}
+
+
+def _woken(readers, rel: Rel, before: Dict[Path, Any], new: Mole) -> List[Rel]:
+    """The other relations reading a path that `rel` changed from `before` (see `_values`) to `new`"""
+    res = []
+    for w in before:
+        if before[w] is new.at(w) or before[w] == new.at(w): continue
+        for path, reader in readers.get(w[0], ()):
+            if reader is not rel and reader not in res and\
+                    (path[:len(w)] == w or w[:len(path)] == path):
+                res.append(reader)
+    return res
 
 
 def rel_p(s: State, rel: Rel):
     """Apply relation `rel` to aid in enumeration"""
-    s.orig.log('#'*30); s.orig.log('Welcome to Relation Phase')
+    s.orig.log('#'*30); s.orig.log('Welcome to Relation Phase'); s.orig.mark('enter', 'rel_p', s.node)
 
-    s.orig.log('Working with relation \"{}\"'.format(rel))
+    s.orig.log('Working with relation \"{}\"', rel)
     if rel.type == 'FUN':
         s.orig.log('It\'s a functional relation')
-        for res in _fun_rel(s, rel):
+        for res in glob.stats.timed('rel_p/FUN', _fun_rel(s, rel)):
             yield res
     elif rel.type == 'UNION':
         s.orig.log('It\'s a union relation')
-        for res in _uni_rel(s, rel):
+        for res in glob.stats.timed('rel_p/UNION', _uni_rel(s, rel)):
             yield res
+    s.orig.mark('exit', 'rel_p')
 
 
 def _fun_rel(s: State, rel):
@@ -270,10 +503,12 @@ def _fun_rel(s: State, rel):
                                max_dep = s.max_dep-1,
                                orig    = s.orig.sub()))
                  for role in in_roles]
-    for legit_in in product(*legit_ins):
+    mark = s.node.mark()
+    for legit_in in _state_product(s, *legit_ins):
+        s.node.undo(mark)
         in_orig = s.orig.branch()
         in_orig.log('Chosen a new input suit')
-        res = s.node.clone()
+        res = s.node.fork()
         for index, inp in enumerate(legit_in):
             res[in_roles[index]] &= inp
         in_orig.log('Attached input suit:'); in_orig.log_m(res)
@@ -282,29 +517,44 @@ def _fun_rel(s: State, rel):
         output = rel['fun'](*arguments)
 
         res[out_path] &= output
+        glob.stats.count('unify')
         in_orig.log('Attached output:')
         in_orig.log_m(res)
         if not res.is_inconsistent():
             in_orig.log('Yielding!')
             yield res
         else:
-            in_orig.log('Inconsistent')
+            glob.stats.count('prune')
+            in_orig.log('Inconsistent'); in_orig.mark('prune', mole=res)
+    s.node.undo(mark)
 
 
 def _uni_rel(s: State, rel):
+    s.orig.log('Narrowing the sets by their bounds')
+    start = s.node.mark()
+    node = narrow_union(s.node, rel)
+    if node is None:
+        glob.stats.count('prune')
+        s.orig.log('Inconsistent'); s.orig.mark('prune', mole=s.node)
+        return
+    narrowed = node.mark()
     s.orig.log('Try enumerating the superset part')
     super_path, subs_path = rel['sup'], rel['subs']
     super_role, subs_role = car(super_path), [car(path) for path in subs_path]
     try:
-        for uni_legit in kenum(s.clone(node    = s.node[super_role],
+        for uni_legit in kenum(s.clone(node    = node[super_role],
                                        max_dep = s.max_dep-1,
                                        orig    = s.orig.sub())):
-            rc = s.node.clone()
+            node.undo(narrowed)
+            rc = node.fork()
             rc[super_role] &= uni_legit
             uni_orig = s.orig.branch()
             uni_orig.log('Chosen the superset part:'); uni_orig.log_m(rc)
-            for sub_path in subs_path[:-1]:
-                rc[sub_path] &= Atom(content=powerset(only(uni_legit)))
+            rc = narrow_union(rc, rel)  # The subsets are now within the superset
+            if rc is None:
+                glob.stats.count('prune')
+                uni_orig.log('Inconsistent'); uni_orig.mark('prune')
+                continue
             uni_orig.log('Updated the subsets')
             uni_orig.log('Result is'); uni_orig.log_m(rc)
 
@@ -313,67 +563,168 @@ def _uni_rel(s: State, rel):
                                         max_dep = s.max_dep-1,
                                         orig    = s.orig.sub()))
                           for sub_role in subs_role[:-1])
-            for sub_suit in product(*legit_subs):
+            chosen = rc.mark()
+            for sub_suit in dprod(*legit_subs):
+                rc.undo(chosen)
                 sub_orig = uni_orig.branch()
                 uni_orig.log('Chosen subsets (except for the last)')
-                res = rc.clone()
+                res = rc.fork()
                 for i, v in enumerate(sub_suit):
                     res[subs_role[i]] &= v
                 sub_orig.log('Attached those:'); sub_orig.log_m(res)
-                subsets_so_far = (only(res[role]) for role in subs_path[:-1])  # type: list (frozen)set
-                union_so_far = reduce(lambda x, y: x | y, subsets_so_far)  # type: (frozen)set
-                leftover = only(uni_legit) - union_so_far  # type: (frozen)set
-                val_for_last = Atom(content=(leftover | x for x in powerset(union_so_far)))
-                res[subs_path[-1]] &= val_for_last
-                sub_orig.log('Attached the superset:'); sub_orig.log_m(res)
-                if not res.is_inconsistent():
+                res = narrow_union(res, rel)  # The last one holds what the others miss
+                glob.stats.count('unify')
+                if res is not None and not res.is_inconsistent():
+                    sub_orig.log('Narrowed the last subset:'); sub_orig.log_m(res)
                     sub_orig.log('Yielding')
                     yield res
                 else:
-                    sub_orig.log('Inconsistent')
+                    glob.stats.count('prune')
+                    sub_orig.log('Inconsistent'); sub_orig.mark('prune')
 
+    except OutOfTimeError:
+        raise
     except KEnumError:
         s.orig.log('Well, that didn\'t work')
         s.orig.log('Then it must mean that the subsets are known')
         subs_legit = (kenum(s.clone(
-                                    node    = s.node[r],
+                                    node    = node[r],
                                     max_dep = s.max_dep-1,
                                     orig    = s.orig.sub()))
                       for r in subs_role)
-        for rs in product(*subs_legit):
+        for rs in dprod(*subs_legit):
+            node.undo(narrowed)
             sub_orig = s.orig.branch()
             sub_orig.log(['Chosen subsets'])
-            res = s.node.clone()
+            res = node.fork()
             for index, v in enumerate(rs):
                 res[subs_role[index]] &= v
             sub_orig.log('Attached those subsets:'); sub_orig.log_m(res)
             subsets: Iterable[set] = (only(res[path]) for path in subs_path)
             superset: Set = reduce(lambda x, y: x | y, subsets)
             res[super_path] &= wr(superset)
+            glob.stats.count('unify')
             sub_orig.log('Attached the union:'); sub_orig.log_m(res)
             if not res.is_inconsistent():
                 sub_orig.log('Yielding')
                 yield res
             else:
-                sub_orig.log('Inconsistent')
+                glob.stats.count('prune')
+                sub_orig.log('Inconsistent'); sub_orig.mark('prune', mole=res)
+    s.node.undo(start)
+
+
+def narrow_union(node: Mole, rel: Rel) -> Optional[Mole]:
+    """
+    Narrow the sets of a UNION relation by their bounds (see `SetBounds`), up
+    to a fixpoint: the superset holds the subsets' lower bounds and lies within
+    their upper bounds, each subset lies within the superset and holds what
+    the other subsets can't. None if there are no such sets, `node` itself if
+    nothing changed (or if it's trailed, then it's written in place).
+    """
+    paths = rel['subs'] + [rel['sup']]
+    bounds = [_bounds_at(node, path) for path in paths]
+    if None in bounds: return node  # Not all sets, nothing to go by
+    old, res = list(bounds), node
+    while True:
+        subs, sup = bounds[:-1], bounds[-1]
+        new_sup = sup & SetBounds(BitSet().union(*(b.lower for b in subs)),
+                                  _union(b.upper for b in subs),
+                                  max(b.lo for b in subs), _sum(b.hi for b in subs))
+        new_subs = []
+        for i, b in enumerate(subs):
+            others = subs[:i] + subs[i+1:]
+            missed, others_hi = _union(o.upper for o in others), _sum(o.hi for o in others)
+            new_subs.append(b & SetBounds(BitSet() if missed is None else new_sup.lower - missed,
+                                          new_sup.upper,
+                                          0 if others_hi is None else new_sup.lo - others_hi,
+                                          new_sup.hi))
+        new = [b.tight() for b in new_subs + [new_sup]]
+        if any(b.is_empty() for b in new): return None
+        if new == bounds: break
+        bounds = new
+    for path, before, after in zip(paths, old, bounds):
+        if after != before:
+            if res is node: res = node.fork()
+            res[path] &= bounded(after)
+    return res
+
+
+def _bounds_at(node: Mole, path: Path) -> Optional[SetBounds]:
+    """The bounds of the set at `path`, unbounded if it's not there yet"""
+    val = node
+    for role in path:
+        if type(val) is not Mole: return None
+        val = val[role]
+    if val is MObj.UNIT: return SetBounds()
+    return as_bounds(val) if type(val) is Atom else None
+
+
+def _union(uppers) -> Optional[BitSet]:
+    uppers = list(uppers)
+    return None if None in uppers else BitSet().union(*uppers)
+
+
+def _sum(his) -> Optional[int]:
+    his = list(his)
+    return None if None in his else sum(his)
+
 
 def fin_p(s: State):
     """Enumerate all children that haven't been enumerated"""
-    s.orig.log('#'*30); s.orig.log('We are now in the Finishing Phase')
-    form = cons_dic[only(s.node['_types'])][only(s.node['_cons'])].form
+    s.orig.log('#'*30); s.orig.log('We are now in the Finishing Phase'); s.orig.mark('enter', 'fin_p', s.node)
+    form = grammar().cons[only(s.node['_types'])][only(s.node['_cons'])].form
     needed_keys = list(form.keys())
     mc_e = [kenum(s.clone(node    = s.node[key],
                           max_dep = s.max_dep-1,
                           orig    = s.orig.sub()))
                   for key in needed_keys]
-    mcs_s = product(*mc_e)
+    mcs_s, mark = _state_product(s, *mc_e), s.node.mark()
     for mcs in mcs_s:
+        s.node.undo(mark)
         mcs_orig = s.orig.branch()
         mcs_orig.log('Chosen a new children suit')
-        res = s.node.clone()
+        res = s.node.fork()
         for index, child in enumerate(mcs):
             res[needed_keys[index]] = child
         mcs_orig.log('Attached children suit:')
         mcs_orig.log_m(res)
+        if res.is_inconsistent():  # Aliased children that don't agree
+            glob.stats.count('prune')
+            mcs_orig.log('Inconsistent'); mcs_orig.mark('prune', mole=res)
+            continue
         mcs_orig.log('Let\'s yield!')
         yield res
+    s.node.undo(mark)
+    s.orig.mark('exit', 'fin_p')
+
+
+if __name__ == '__main__':
+    import random
+    from itertools import combinations
+    rnd, elems = random.Random(0), [1, 2, 3, 4]
+    subsets = [BitSet(s) for r in range(5) for s in combinations(elems, r)]
+
+    def some_atom():
+        if rnd.random() < 0.3: return Atom(content=rnd.sample(subsets, rnd.randrange(1, 4)))
+        lower = rnd.choice(subsets)
+        upper = rnd.choice([None] + [s for s in subsets if lower <= s])
+        lo = rnd.randrange(3)
+        return bounded(SetBounds(lower, upper, lo, rnd.choice([None, lo + 1, lo + 2])))
+
+    rel, found, narrowed = Rel(type_='UNION', subs=['a', 'b'], sup='c'), 0, 0
+    for _ in range(3000):
+        node = Mole(a=some_atom(), b=some_atom(), c=some_atom())
+        if node.is_inconsistent(): continue
+        res = narrow_union(node, rel)
+        solutions = [(x, y, x | y) for x in subsets for y in subsets
+                     if node['a'](x) and node['b'](y) and node['c'](x | y)]
+        found += bool(solutions)
+        if res is None:
+            assert not solutions, node  # Only when there is none
+            continue
+        narrowed += res is not node
+        for x, y, z in solutions:  # None is lost
+            assert res['a'](x) and res['b'](y) and res['c'](z), (node, res, (x, y, z))
+    assert found and narrowed
+    print('narrow_union: ok')
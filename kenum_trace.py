@@ -0,0 +1,257 @@
+"""
+Binary traces of kenum, and a viewer for them.
+
+    orig = TraceNode(Recorder('logs/trace.bin'))
+    list(kenum(State(node=root, max_dep=5, orig=orig)))
+    orig.recorder.close()
+
+    python kenum_trace.py logs/trace.bin            # Summary
+    python kenum_trace.py logs/trace.bin tree 0a --depth 3
+    python kenum_trace.py logs/trace.bin show 0a1   # What happened at a node
+    python kenum_trace.py logs/trace.bin text       # The whole thing, as debug.log
+"""
+from khoa_math import *
+from call_tree import *
+
+from typing import *
+import argparse, pickle, struct, time
+
+
+MAGIC = b'KTRACE1\n'
+
+# Record tags, each record is a tag byte followed by the fields
+STR, ATOM, ATOM_REPR, MOLE, NODE, MSG, SHOW, EVENT = range(1, 9)
+EVENTS = ['enter', 'exit', 'yield', 'prune', 'timeout']
+
+_I, _II, _IIB, _IH = struct.Struct('<I'), struct.Struct('<II'), struct.Struct('<IIB'), struct.Struct('<IH')
+_EVENT = struct.Struct('<IBIId')
+
+
+class Recorder:
+    """
+    Writes a trace to `path`, as records appended one after another.
+    Strings, atoms and molecules are written once and referred to by number
+    afterwards (0 stands for nothing). Strings and objects are numbered apart.
+    """
+    def __init__(self, path: str):
+        self.file = open(path, 'wb')
+        self.file.write(MAGIC)
+        self.strs, self.objs = {}, {}
+        self.nodes = 0  # The root node is 0
+
+    def close(self):
+        self.file.close()
+
+    def _write(self, tag, struct_, *fields, tail=b''):
+        self.file.write(bytes((tag,)) + struct_.pack(*fields) + tail)
+
+    def str_(self, s: str) -> int:
+        res = self.strs.get(s)
+        if res is None:
+            res = self.strs[s] = len(self.strs) + 1
+            data = s.encode()
+            self._write(STR, _II, res, len(data), tail=data)
+        return res
+
+    def ref(self, obj: Union[Mole, Atom]) -> int:
+        obj = obj.freeze()
+        res = self.objs.get(obj)
+        if res is not None: return res
+        if type(obj) is Mole:
+            items = [(self.str_(k), self.ref(v)) for k, v in obj.items()]
+            res = self.objs[obj] = len(self.objs) + 1
+            self._write(MOLE, _IH, res, len(items),
+                        tail=b''.join(_II.pack(*item) for item in items))
+        else:
+            res = self.objs[obj] = len(self.objs) + 1
+            try:
+                data, tag = pickle.dumps(obj), ATOM
+            except (pickle.PicklingError, AttributeError, TypeError):
+                data, tag = repr(obj).encode(), ATOM_REPR
+            self._write(tag, _II, res, len(data), tail=data)
+        return res
+
+    def node(self, parent: int, how: int) -> int:
+        """A new node under `parent`, by `branch` (0) or `sub` (1)"""
+        self.nodes += 1
+        self._write(NODE, _IIB, self.nodes, parent, how)
+        return self.nodes
+
+    def _arg(self, arg) -> bytes:
+        if type(arg) in (Mole, Atom): return b'\x01' + _I.pack(self.ref(arg))
+        else: return b'\x00' + _I.pack(self.str_(str(arg)))
+
+    def msg(self, node: int, msg: str, args: tuple):
+        self._write(MSG, _IIB, node, self.str_(str(msg)), len(args),
+                    tail=b''.join(map(self._arg, args)))
+
+    def show(self, node: int, mole):
+        self._write(SHOW, _IIB, node, *((self.ref(mole), 1) if type(mole) in (Mole, Atom)
+                                       else (self.str_(str(mole)), 0)))
+
+    def event(self, node: int, event: str, name: str = None, mole=None):
+        self._write(EVENT, _EVENT, node, EVENTS.index(event),
+                    0 if name is None else self.str_(name),
+                    0 if mole is None else self.ref(mole), time.time())
+
+
+class TraceNode(LogNode):
+    """A `LogNode` that records into a `Recorder` instead of writing text"""
+    def __init__(self, recorder: Recorder, id_: int = 0):
+        self.recorder, self.id = recorder, id_
+        self.on = True
+
+    def log(self, msg, *args, level=50):
+        if self.on: self.recorder.msg(self.id, msg, args)
+
+    def log_m(self, mole, level=50):
+        if self.on: self.recorder.show(self.id, mole)
+
+    def mark(self, event, name=None, mole=None):
+        if self.on: self.recorder.event(self.id, event, name, mole)
+
+    def branch(self):
+        if not self.on: return NULL
+        return TraceNode(self.recorder, self.recorder.node(self.id, 0))
+
+    def sub(self):
+        if not self.on: return NULL
+        return TraceNode(self.recorder, self.recorder.node(self.id, 1))
+
+
+class Trace:
+    """
+    A trace read back. Nodes get their `LogNode` prefixes back, and
+    molecules are rebuilt only when asked for (`obj`).
+    """
+    def __init__(self, path: str):
+        with open(path, 'rb') as f: data = f.read()
+        assert data.startswith(MAGIC), 'Not a trace: {}'.format(path)
+        self.strs, self._defs, self._objs = [None], {}, {}
+        self.parent, self.prefix, self.children = {0: None}, {0: ''}, {0: []}
+        self.entries = {0: []}  # Node -> [(tag, fields)]
+        choices = {0: 0}
+
+        pos = len(MAGIC)
+        while pos < len(data):
+            tag = data[pos]; pos += 1
+            if tag == STR:
+                _, n = _II.unpack_from(data, pos); pos += 8
+                self.strs.append(data[pos:pos+n].decode()); pos += n
+            elif tag in (ATOM, ATOM_REPR):
+                id_, n = _II.unpack_from(data, pos); pos += 8
+                self._defs[id_] = (tag, data[pos:pos+n]); pos += n
+            elif tag == MOLE:
+                id_, n = _IH.unpack_from(data, pos); pos += 6
+                items = [_II.unpack_from(data, pos + 8*i) for i in range(n)]; pos += 8*n
+                self._defs[id_] = (tag, items)
+            elif tag == NODE:
+                id_, parent, how = _IIB.unpack_from(data, pos); pos += 9
+                if how == 0:
+                    self.prefix[id_] = self.prefix[parent] + str(choices[parent])
+                    choices[parent] += 1
+                else:
+                    self.prefix[id_] = self.prefix[parent] + 'a'
+                self.parent[id_], choices[id_] = parent, 0
+                self.children[id_], self.entries[id_] = [], []
+                self.children[parent].append(id_)
+            elif tag == MSG:
+                node, fmt, n = _IIB.unpack_from(data, pos); pos += 9
+                args = [(data[pos + 5*i], _I.unpack_from(data, pos + 5*i + 1)[0]) for i in range(n)]
+                pos += 5*n
+                self.entries[node].append((MSG, (fmt, args)))
+            elif tag == SHOW:
+                node, ref, is_obj = _IIB.unpack_from(data, pos); pos += 9
+                self.entries[node].append((SHOW, (ref, is_obj)))
+            elif tag == EVENT:
+                node, event, name, ref, when = _EVENT.unpack_from(data, pos); pos += _EVENT.size
+                self.entries[node].append((EVENT, (EVENTS[event], self.strs[name] if name else None,
+                                                   ref, when)))
+            else:
+                raise ValueError('Bad record {} at byte {}'.format(tag, pos - 1))
+
+    def obj(self, id_: int):
+        """The molecule or atom numbered `id_`"""
+        res = self._objs.get(id_)
+        if res is None:
+            tag, data = self._defs[id_]
+            if tag == MOLE: res = Mole(**{self.strs[k]: self.obj(v) for k, v in data})
+            elif tag == ATOM: res = pickle.loads(data)
+            else: res = Atom(qualifier=lambda x: False, custom_repr=data.decode())
+            self._objs[id_] = res
+        return res
+
+    def find(self, prefix: str) -> int:
+        for id_, p in self.prefix.items():
+            if p == prefix: return id_
+        raise KeyError('No node {}'.format(prefix))
+
+    def _msg(self, fmt, args) -> str:
+        args = [self.obj(i) if is_obj else self.strs[i] for is_obj, i in args]
+        return self.strs[fmt].format(*args) if args else self.strs[fmt]
+
+    def render(self, node: int) -> Iterator[str]:
+        """The lines a text `LogNode` would have written for this node"""
+        for tag, fields in self.entries[node]:
+            if tag == MSG:
+                yield '[{}]: {}'.format(self.prefix[node], self._msg(*fields))
+            elif tag == SHOW:
+                ref, is_obj = fields
+                yield '{}\n'.format(self.obj(ref) if is_obj else self.strs[ref])
+            else:
+                event, name, ref, _ = fields
+                yield '[{}]: <{}{}{}>'.format(self.prefix[node], event,
+                                             '' if name is None else ' ' + name,
+                                             '' if not ref else ' #{}'.format(ref))
+
+    def text(self) -> Iterator[str]:
+        """Every node, in the order they were created"""
+        for node in sorted(self.entries):
+            for line in self.render(node):
+                yield line
+
+    def tree(self, node: int = 0, depth: Optional[int] = None, indent: int = 0) -> Iterator[str]:
+        """One line per node: prefix, first message and events"""
+        first = next((self._msg(*f) for t, f in self.entries[node]
+                      if t == MSG and self.strs[f[0]].strip('#')), '')
+        events = [f[0] for t, f in self.entries[node] if t == EVENT]
+        counts = ' '.join('{}:{}'.format(e, events.count(e)) for e in EVENTS if e in events)
+        yield '{}[{}] {} {}'.format('  '*indent, self.prefix[node], first, counts).rstrip()
+        if depth is None or depth > 0:
+            for child in self.children[node]:
+                for line in self.tree(child, None if depth is None else depth-1, indent+1):
+                    yield line
+
+    def summary(self) -> str:
+        events = [f[0] for entries in self.entries.values() for t, f in entries if t == EVENT]
+        return '{} nodes, {} strings, {} molecules and atoms\n{}'.format(
+            len(self.prefix), len(self.strs) - 1, len(self._defs),
+            '\n'.join('{}: {}'.format(e, events.count(e)) for e in EVENTS))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Look into a kenum trace')
+    parser.add_argument('path')
+    sub = parser.add_subparsers(dest='command')
+    tree = sub.add_parser('tree', help='The branch tree')
+    tree.add_argument('prefix', nargs='?', default='')
+    tree.add_argument('--depth', type=int)
+    show = sub.add_parser('show', help='What happened at one node')
+    show.add_argument('prefix')
+    mole = sub.add_parser('mole', help='A molecule, by number')
+    mole.add_argument('id', type=int)
+    sub.add_parser('text', help='Everything, like the text log')
+    args = parser.parse_args(argv)
+
+    t = Trace(args.path)
+    if args.command == 'tree': lines = t.tree(t.find(args.prefix), args.depth)
+    elif args.command == 'show': lines = t.render(t.find(args.prefix))
+    elif args.command == 'mole': lines = [repr(t.obj(args.id))]
+    elif args.command == 'text': lines = t.text()
+    else: lines = [t.summary()]
+    for line in lines:
+        print(line)
+
+
+if __name__ == '__main__':
+    main()
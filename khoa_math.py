@@ -1,8 +1,11 @@
 from misc import *
+from bitset import *
+from pred import *
 
 from typing import *
 from enum import Enum
 from pprint import pformat
+import weakref, pickle
 
 
 class MObj(Enum):
@@ -16,37 +19,71 @@ class Atom:
                  content: Optional[Iterable] = None,
                  qualifier: Optional[Callable[..., bool]] = None,
                  custom_repr: Optional[str] = None):
-        """Content should be set for better performance"""
+        """
+        Content should be set for better performance. The qualifier is a
+        predicate (see `pred.py`), any other function is taken as `Opaque`.
+        """
         assert((content is None) ^ (qualifier is None)),\
                 'One and only one of either content or qualifier should be present'
+        if qualifier is not None and type(qualifier) not in PREDS: qualifier = Opaque(qualifier)
         self.content = content
         self.qualifier, self.custom_repr = qualifier, custom_repr
+        self._frozen, self._hash = False, None
 
     @property
-    def content(self):
-        if self._content is None: return None
-        else:
-            save, res = tee(self._content)
-            # Iteration on the content property won't affect the original iterable
-            self._content = save
-            return res
+    def content(self) -> Optional[tuple]:
+        """Explicit content is materialized into a tuple on the first read"""
+        if self._content is not None and type(self._content) is not tuple:
+            self._content, self._head = self._head + tuple(self._content), ()
+        return self._content
 
     @content.setter
     def content(self, value):
-        self._content = value
+        self._content, self._members, self._head = value, None, ()
+
+    def members(self) -> frozenset:
+        """The content as a (cached) frozenset, for explicit atoms only"""
+        if self._members is None:
+            self._members = frozenset(self.content)
+        return self._members
 
     def __eq__(self, other):
-        if self.qualifier is None and other.qualifier is None:
-            return set(self.content) == set(other.content)
+        if self is other: return True
+        elif type(other) is not Atom: return NotImplemented
+        elif self._frozen and other._frozen: return False  # Interned
+        elif self.qualifier is None and other.qualifier is None:
+            return self.members() == other.members()
         else:
             return self.qualifier == other.qualifier
 
     def __hash__(self) -> int:
-        if self.content is not None:
-            return hash(frozenset(self.content))
+        if self._hash is not None: return self._hash
+        elif self.is_explicit():
+            return hash(self.members())
         else: return hash(self.qualifier)
 
+    def freeze(self) -> 'Atom':
+        """Return the interned copy of this atom (explicit content gets materialized)"""
+        if self._frozen: return self
+        key = self.members() if self.is_explicit() else self.qualifier
+        res = _atoms.get(key)
+        if res is None:
+            if self.is_explicit():
+                res = Atom(content=self.content, custom_repr=self.custom_repr)
+            else:
+                res = Atom(qualifier=self.qualifier, custom_repr=self.custom_repr)
+            res._frozen, res._hash = True, hash(key)
+            _atoms[key] = res
+        return res
+
+    def __reduce__(self):
+        """Implicit atoms can only be pickled if their predicate has no `Opaque` function"""
+        if self.is_explicit():
+            return (_load_atom, (self.content, None, self.custom_repr, self._frozen))
+        return (_load_atom, (None, self.qualifier, self.custom_repr, self._frozen))
+
     def clone(self) -> 'Atom':
+        if self._frozen: return self  # Nothing can change it
         # Content is already a copy, qualifier and custom_repr are immutable
         return Atom(self.content, self.qualifier, self.custom_repr)
 
@@ -61,21 +98,26 @@ class Atom:
         core: str
         if self.custom_repr: core = self.custom_repr
         elif self.is_explicit(): core = ' | '.join(map(recur, self.content))
-        else: core = '?' + str(self.qualifier) + '?'
+        else: core = repr(self.qualifier)
         return '{}{}{}'.format(left_sur, core, right_sur)
 
     def __len__(self) -> int:
-        if hasattr(self.content, '__len__'): return len(self.content)
-        else: return sum(1 for _ in self.content)
+        return len(self.content)
 
     def is_explicit(self):
-        return (self.content is not None)
+        return (self._content is not None)
+
+    def is_bounds(self):
+        """True for a set interval (see `SetBounds`)"""
+        return type(self.qualifier) is SetBounds
+
+    def is_finite(self):
+        """True if the values can be listed: explicit atoms and bounded intervals"""
+        return self.is_explicit() or self.is_bounds() and self.qualifier.upper is not None
 
     def __getitem__(self, index: int):
         """For explicit atoms only."""
-        res = nth(self.content, index)
-        if res is not None: return res
-        else: raise IndexError
+        return self.content[index]
 
     def __iter__(self):
         """For explicit atoms only."""
@@ -83,17 +125,28 @@ class Atom:
 
     def __call__(self, val):
         """Usable for all atoms."""
-        if self.is_explicit(): return (val in self.content)
+        if self.is_explicit():
+            try: return (val in self.members())
+            except TypeError: return (val in self.content)  # Unhashable
         else: return self.qualifier(val)
 
     def is_empty(self):
-        return (len(self) == 0) if self.is_explicit() else False
+        """Lazy content is only pulled for its first value (kept in `_head`)"""
+        if not self.is_explicit(): return self.is_bounds() and self.qualifier.is_empty()
+        if hasattr(self._content, '__len__'): return len(self._content) == 0
+        if self._head: return False
+        rest = self._content = iter(self._content)
+        for first in rest:
+            self._head = (first,)
+            return False
+        self._content = ()
+        return True
 
     def is_singleton(self):
         return (len(self) == 1) if self.is_explicit() else False
 
     def __and__(self, other: Union['Atom', 'Mole', 'MObj']):
-        if other is MObj.UNIT:
+        if other is MObj.UNIT or other is self and self._frozen:
             return self
         elif type(other) is Mole:
             return NONE
@@ -102,12 +155,8 @@ class Atom:
             e1, e2 = self.is_explicit(), other.is_explicit()
             if e1:
                 if e2:
-                    # Both are explicit: result is explicit
-                    try:
-                        # Special treatment for types that implements union
-                        res = Atom(content = self.content & other.content)
-                    except TypeError:
-                        res = Atom(content = filter(other, self))
+                    # Both are explicit: result is explicit (and lazy)
+                    res = Atom(content = filter(other, self))
                 else:
                     # Only `self` is explicit: result is explicit
                     res = Atom(content = filter(other, self))
@@ -115,55 +164,255 @@ class Atom:
                 # Only `other` is explicit: result is explicit
                 res = Atom(content = filter(self, other))
             else:
-                # Either is explicit: result is implicit
-                res = Atom(qualifier = lambda x: self(x) and other(x))
+                # Neither is explicit: result is implicit, or empty if it's a contradiction
+                q = conj(self.qualifier, other.qualifier)
+                if q is None: res = Atom(content = ())
+                elif type(q) is SetBounds: res = bounded(q)
+                else: res = Atom(qualifier = q)
             return res
 
 
+# Interned atoms and molecules, keyed by their content
+_atoms = weakref.WeakValueDictionary()
+_moles = weakref.WeakValueDictionary()
+
+
 # Some handy atoms
-ANY       = Atom(qualifier = lambda x: True, custom_repr='ANY')
+ANY       = Atom(qualifier = TRUE, custom_repr='ANY')
 NONE      = Atom(content   = set(), custom_repr='NONE')
-STR       = Atom(qualifier = lambda x: type(x) is str, custom_repr='STR')
-SET       = Atom(qualifier = lambda x: type(x) in [set, frozenset],
-            custom_repr='SET')
-INT       = Atom(qualifier = lambda x: type(x) is int, custom_repr='INT')
-SINGLETON = Atom(qualifier = lambda x: type(x) in [set, frozenset] and len(x) == 1)
+STR       = Atom(qualifier = Tag('STR'), custom_repr='STR')
+SET       = Atom(qualifier = Tag('SET'), custom_repr='SET')
+INT       = Atom(qualifier = Tag('INT'), custom_repr='INT')
+SINGLETON = Atom(qualifier = SetBounds(lo=1, hi=1), custom_repr='SINGLETON')
+# Implicit atoms that can be written by name (see `codec.py`)
+_named = {atom.custom_repr: atom for atom in [ANY, STR, SET, INT, SINGLETON]}
+
+
+def bounded(bounds: SetBounds) -> Atom:
+    """The atom of the sets in `bounds`, made explicit if there's at most one"""
+    b = bounds.tight()
+    if b.is_empty(): return Atom(content=())
+    elif b.lower == b.upper: return Atom(content=(b.lower,))
+    elif b.upper is not None and b.lo == b.hi == len(b.upper): return Atom(content=(b.upper,))
+    elif b.hi == len(b.lower): return Atom(content=(b.lower,))
+    return Atom(qualifier=b)
+
+
+def as_bounds(atom: Atom) -> Optional[SetBounds]:
+    """
+    The interval an atom of sets lies in: exact for intervals (like SINGLETON)
+    and SET, the smallest one around an explicit atom of sets, None for
+    anything else
+    """
+    if atom.is_bounds(): return atom.qualifier
+    elif atom.qualifier == SET.qualifier: return SetBounds()
+    elif atom.is_explicit() and len(atom) > 0 and all(map(is_set, atom)):
+        return SetBounds(BitSet(atom[0]).intersection(*atom[1:]), BitSet().union(*atom),
+                         min(map(len, atom)), max(map(len, atom)))
+    return None
+
+
+def _load_atom(content, qualifier, custom_repr, frozen):
+    """`qualifier` may also be the name of an implicit atom (older pickles)"""
+    if qualifier is None: res = Atom(content=content, custom_repr=custom_repr)
+    elif type(qualifier) is str: res = Atom(qualifier=_named[qualifier].qualifier, custom_repr=custom_repr)
+    else: res = Atom(qualifier=qualifier, custom_repr=custom_repr)
+    return res.freeze() if frozen else res
+
+
+class Trail(list):
+    """The writes into a trailed molecule, in order, so that they can be undone"""
+    def undo(self, mark: int):
+        """Undo the writes made since `mark` (the length of the trail back then)"""
+        while len(self) > mark:
+            target, key, old = self.pop()
+            if type(target) is set:  # A `_bad` flag
+                if old: target.add(key)
+                else: target.discard(key)
+            elif old is _MISSING: dict.__delitem__(target, key)
+            else: dict.__setitem__(target, key, old)
+
+
+_MISSING = object()
 
 
 class Mole(dict):
+    clones = 0  # Counts every `clone`, for the stats
+    _trail = None  # See `trailed`
+    _aliases = ()  # See `alias`
+
     def __init__(self, **kwargs):
         super().__init__(**kwargs)
+        self._frozen, self._hash, self._complexity = False, None, None
+        self._bad = {key for key, val in kwargs.items() if _is_bad(val)}
 
     @property
     def complexity(self):
-        return 1 + sum(k.complexity for k in self.values() if type(k) is Mole)
+        """Cached once frozen"""
+        if self._complexity is not None: return self._complexity
+        res = 1 + sum(k.complexity for k in self.values() if type(k) is Mole)
+        if self._frozen: self._complexity = res
+        return res
 
-    def __setitem__(self, path: str, value):
+    def __setitem__(self, path: Union[str, Path], value):
         assert(type(value) in [Mole, Atom]),\
                 'Watch the type!'
-        assert(path != ''),\
+        assert(path != '' and path != ()),\
                 'You don\'t have to do this! You don\'t need to do this!'
-        if car(path) == path:
+        if self._frozen:
+            raise TypeError('Frozen molecules cannot be modified, clone it first')
+        self._write(path, value)
+        if self._aliases: self._sync(as_path(path))
+
+    def _write(self, path: Union[str, Path], value):
+        trail = self._trail
+        if type(path) is str and '/' not in path:
+            if trail is not None: trail.append((self, path, dict.get(self, path, _MISSING)))
             super().__setitem__(path, value)
-        else:
-            if car(path) in self:
-                self[car(path)][cdr(path)] = value
-            else:
-                self[car(path)] = Mole()  # This is the commitment
-                self[car(path)][cdr(path)] = value
+            self._mark(path, _is_bad(value), trail)
+            return
+        path, node, spine = as_path(path), self, []
+        for i in range(len(path) - 1):
+            child = dict.get(node, path[i])
+            if child is None or type(child) is Mole and child._frozen:
+                if trail is not None: trail.append((node, path[i], _MISSING if child is None else child))
+                child = Mole() if child is None else child.clone()  # Commitment, or copy on write
+                dict.__setitem__(node, path[i], child)
+            spine.append(node)
+            node = child
+        if trail is not None: trail.append((node, path[-1], dict.get(node, path[-1], _MISSING)))
+        dict.__setitem__(node, path[-1], value)
+        changed = node._mark(path[-1], _is_bad(value), trail)
+        for i in reversed(range(len(spine))):
+            if not changed: break  # Nothing changes further up either
+            changed = spine[i]._mark(path[i], bool(node._bad), trail)
+            node = spine[i]
+
+    def _mark(self, key: str, bad: bool, trail: Trail = None) -> bool:
+        """Record whether the child at `key` is inconsistent, True if that changed"""
+        if bad == (key in self._bad): return False
+        if trail is not None: trail.append((self._bad, key, not bad))
+        if bad: self._bad.add(key)
+        else: self._bad.discard(key)
+        return True
+
+    def alias(self, left: Union[str, Path], right: Union[str, Path]):
+        """
+        Make the paths `left` and `right` hold one and the same value from now
+        on: their values are unified, and after each write through a path
+        from this molecule, the (frozen) value of an alias class is written
+        to all of its paths. Classes are merged as paths are joined.
+        Clones and pickles keep the classes, frozen copies don't.
+        """
+        left, right = as_path(left), as_path(right)
+        joined = [c for c in self._aliases if left in c or right in c]
+        merged = tuple(sorted({left, right}.union(*joined)))
+        self._aliases = tuple(c for c in self._aliases if c not in joined) + (merged,)
+        self._sync(left)
+
+    def aliased(self, path: Union[str, Path]) -> List[Path]:
+        """The other paths whose value changes along with that at `path`"""
+        path, res = as_path(path), []
+        for members in self._aliases:
+            for m in members:
+                if path[:len(m)] == m:  # Within `m`, so within the others too
+                    res.extend(as_path(o + path[len(m):]) for o in members if o != m)
+                elif m[:len(path)] == path:  # `m` is within `path`
+                    res.extend(o for o in members if o[:len(path)] != path)
+        return res
 
-    def __getitem__(self, path: str):
-        if path == '': return self  # Special property
-        elif car(path) == path: return super().__getitem__(path)
-        else: return self[car(path)][cdr(path)]
+    def _sync(self, written: Path):
+        """Give each alias class that `written` touches the meet of its values, up to a fixpoint"""
+        todo = [written]
+        while todo:
+            path = todo.pop()
+            for members in self._aliases:
+                if not any(path[:len(m)] == m or m[:len(path)] == path for m in members):
+                    continue
+                vals = [self.at(m) for m in members]
+                val = vals[0]
+                for other in vals[1:]:
+                    if other is not val: val = val & other
+                if val is MObj.UNIT: continue
+                val = val.freeze()
+                for m, old in zip(members, vals):
+                    if old is not val:
+                        self._write(m, val)
+                        todo.append(m)
+
+    def at(self, path: Union[str, Path]):
+        """The value at `path`, UNIT if there's none"""
+        res = self
+        for role in as_path(path):
+            if type(res) is not Mole: return MObj.UNIT
+            res = dict.get(res, role, MObj.UNIT)
+        return res
+
+    def trailed(self) -> 'Mole':
+        """
+        Record the writes into this molecule (through paths from it) on a
+        trail: it's then written in place by the branches (see `fork`), which
+        backtrack with `mark` and `undo`. Returns the molecule itself.
+        """
+        assert not self._frozen, 'Frozen molecules cannot be modified, clone it first'
+        self._trail = Trail()
+        return self
+
+    def fork(self) -> 'Mole':
+        """The molecule a branch writes into: this one if it's trailed, else a clone"""
+        return self if self._trail is not None else self.clone()
+
+    def mark(self) -> Optional[int]:
+        return None if self._trail is None else len(self._trail)
+
+    def undo(self, mark: Optional[int]):
+        """Back to how it was at `mark`, for trailed molecules"""
+        if self._trail is not None: self._trail.undo(mark)
+
+    def __getitem__(self, path: Union[str, Path]):
+        if type(path) is str:
+            if path == '': return self  # Special property
+            elif '/' not in path: return super().__getitem__(path)
+            path = as_path(path)
+        res = self
+        for role in path:
+            res = dict.__getitem__(res, role)
+        return res
 
     def __missing__(self, key):
         return MObj.UNIT
 
     def __hash__(self) -> int:
-        """Hopefully this does not take too much time"""
+        """Free for frozen molecules, others hash their whole tree"""
+        if self._hash is not None: return self._hash
         return hash(tuple(sorted(self.items(), key=lambda item: item[0])))
 
+    def __eq__(self, other):
+        if self is other: return True
+        elif self._frozen and getattr(other, '_frozen', False): return False  # Interned
+        else: return super().__eq__(other)
+
+    def __ne__(self, other):
+        res = self.__eq__(other)
+        return res if res is NotImplemented else not res
+
+    def __reduce__(self):
+        return (_load_mole, (dict(self), self._frozen, self._aliases))
+
+    def freeze(self) -> 'Mole':
+        """
+        Return the interned, immutable copy of this molecule.
+        Equal molecules freeze to the very same object.
+        """
+        if self._frozen: return self
+        key = tuple(sorted((k, v.freeze()) for k, v in self.items()))
+        res = _moles.get(key)
+        if res is None:
+            res = Mole(**dict(key))
+            res._frozen, res._hash = True, hash(key)
+            _moles[key] = res
+        return res
+
     def __repr__(self) -> str:
         def normalize(self):
             res = {}
@@ -184,7 +433,7 @@ class Mole(dict):
         return pformat(prune(normalize(self)))
 
     def __and__(self, other: ['Mole', Atom, MObj]):
-        if other is MObj.UNIT:
+        if other is MObj.UNIT or other is self and self._frozen:
             return self
         elif type(other) is Atom:
             return NONE
@@ -195,25 +444,39 @@ class Mole(dict):
             return res
     
     def is_inconsistent(self) -> bool:
-        res = False
-        for key in self:
-            if type(self[key]) is Mole and self[key].is_inconsistent():
-                res = True; break
-            elif type(self[key]) is Atom and self[key].is_empty():
-                res = True; break
-        return res
+        """
+        O(1): each molecule keeps the roles holding an empty atom or an
+        inconsistent molecule (`_bad`), updated along the path of every write
+        """
+        return bool(self._bad)
 
     def clone(self) -> 'Mole':
-        res = Mole()
-        for key in self:
-            # `self[key]` is a `Atom` or `Mole`, which has clone()
-            res[key] = self[key].clone()
+        """
+        Shallow copy: both molecules share the frozen children, and writing
+        through a path only copies the molecules along that path. The copy
+        gets frozen copies of the other children, this molecule keeps them.
+        """
+        res = Mole(**{key: val.freeze() for key, val in self.items()})
+        res._aliases = self._aliases
+        Mole.clones += 1
         return res
 
 
+def _is_bad(val) -> bool:
+    return bool(val._bad) if type(val) is Mole else val.is_empty()
+
+
+def _load_mole(items, frozen, aliases=()):
+    res = Mole(**items)
+    res._aliases = tuple(tuple(map(as_path, members)) for members in aliases)
+    return res.freeze() if frozen else res
+
+
 def wr(value):
-    """Stands for 'wrap'"""
-    return value if type(value) is Mole else Atom(content={value})
+    """Stands for 'wrap', sets are made `BitSet`s"""
+    if type(value) is Mole: return value
+    elif type(value) in (set, frozenset): value = BitSet(value)
+    return Atom(content={value})
 
 
 def only(singleton: Union[Atom, Mole]):
@@ -255,3 +518,43 @@ if __name__ == '__main__':
     print('Atom 3\'s complexity: {}'.format(atom3.complexity))
     print('Atom 5\'s complexity: {}'.format(atom5.complexity))
     print('Atom 8\'s complexity: {}'.format(atom8.complexity))
+
+    # Trailed molecules are written in place, and `undo` brings them back exactly
+    frozen = Mole(x=wr('1')).freeze()
+    m = Mole(a=frozen, b=wr('2')).trailed()
+    plain = Mole(b=wr('2'))
+    assert m.fork() is m and plain.fork() is not plain and plain.mark() is None
+    before, start = m.freeze(), m.mark()
+    m['a/x'] = NONE  # Copy on write of a frozen child, marks `a` bad all the way up
+    assert m['a'] is not frozen and frozen['x'] == wr('1') and m.is_inconsistent()
+    inner = m.mark()
+    m['c/d/e'] = wr('3'); m['b'] = wr('4'); m['a/x'] = wr('5')
+    assert not m.is_inconsistent() and m['c/d/e'] == wr('3')
+    m.undo(inner)
+    assert m.is_inconsistent() and 'c' not in m and m['b'] == wr('2') and m['a/x'] == NONE
+    m.undo(start)
+    assert m.freeze() is before and m['a'] is frozen and not m.is_inconsistent() and not m._trail
+    print('Trail: ok')
+
+    # Aliased paths hold the meet of their values, whichever path is written
+    m = Mole(l=Atom({'1', '2'}), r=Mole(v=Atom({'2', '3'})))
+    m.alias('l', 'r/v')
+    assert m['l'] is m['r/v'] and m['l'] == wr('2')
+    m['s/v'] = STR
+    m.alias('s/v', 'l')  # Joins the class
+    assert m._aliases == ((('l',), ('r', 'v'), ('s', 'v')),) and m['s/v'] is m['l'] == wr('2')
+    m.alias('p', 'q')
+    m['p/w'] = wr('x')  # Within a member
+    assert m['q/w'] == wr('x') and sorted(m.aliased('q/w')) == [('p', 'w')]
+    m['q'] = Mole(w=Atom({'x', 'y'}), z=wr('z'))  # The member itself
+    assert m['p'] is m['q'] and m['p/w'] == wr('x') and m['p/z'] == wr('z')
+    m['r'] = Mole(v=wr('2'), u=wr('u'))  # Above a member
+    assert m['l'] is m['r/v'] and not m.is_inconsistent()
+    assert sorted(m.aliased('r')) == [('l',), ('s', 'v')] and m.aliased('u') == []
+    copy, loaded = m.clone(), pickle.loads(pickle.dumps(m))
+    for n in [copy, loaded]:
+        assert n == m and n._aliases == m._aliases
+        n['s/v'] = wr('3')  # Inconsistent with the class
+        assert n['l'] == n['r/v'] == NONE and n.is_inconsistent()
+    assert m['l'] == wr('2') and not m.is_inconsistent()
+    print('Aliases: ok')
@@ -0,0 +1,129 @@
+"""
+Legit molecules kept on disk, so that the next runs don't work them out again.
+
+    glob.legits = LegitStore('legits')
+
+The store is a set, usable in place of `glob.legits`. On disk it's a directory
+per grammar (named by `Grammar.fingerprint` and marked by a `_MARKER` file, the
+other marked ones are stale and removed, nothing else is touched),
+with a file per type and constructor. A file is only read when a molecule of its
+type and constructor is looked up. Several processes can share a store: new
+molecules are appended under a lock, a few at a time (see `flush`).
+"""
+from khoa_math import *
+from grammar import grammar
+
+from typing import *
+from collections.abc import MutableSet
+import atexit, fcntl, os, pickle, shutil, struct
+
+
+_LEN = struct.Struct('<I')
+_MARKER = '.legit_store'  # In each grammar's directory, only those are ever removed
+
+
+class LegitStore(MutableSet):
+    def __init__(self, path: str, batch: int = 100):
+        self.path, self.batch = path, batch
+        self._fingerprint = None
+        self._buckets = {}   # (type, cons) -> set of molecules
+        self._pending = {}   # (type, cons) -> [records not written yet]
+        atexit.register(self.flush)
+
+    @classmethod
+    def _from_iterable(cls, it):
+        return set(it)  # Results of set operations stay in memory
+
+    def _dir(self) -> str:
+        fingerprint = grammar().fingerprint
+        if fingerprint != self._fingerprint:
+            # Whatever was loaded or not written yet belongs to another grammar
+            self._fingerprint, self._buckets, self._pending = fingerprint, {}, {}
+            os.makedirs(os.path.join(self.path, fingerprint), exist_ok=True)
+            open(os.path.join(self.path, fingerprint, _MARKER), 'a').close()
+            for name in os.listdir(self.path):
+                stale = os.path.join(self.path, name)
+                if name != fingerprint and os.path.isfile(os.path.join(stale, _MARKER)):
+                    shutil.rmtree(stale, ignore_errors=True)
+        return os.path.join(self.path, self._fingerprint)
+
+    def _file(self, key) -> str:
+        return os.path.join(self._dir(), '{}.{}'.format(*key))
+
+    def _bucket(self, key) -> set:
+        res = self._buckets.get(key)
+        if res is None:
+            res = self._buckets[key] = set(self._load(self._file(key)))
+        return res
+
+    def _load(self, file: str) -> Iterator[Mole]:
+        try:
+            with open(file, 'rb') as f:
+                fcntl.flock(f, fcntl.LOCK_SH)
+                data = f.read()
+        except FileNotFoundError:
+            return
+        pos = 0
+        while pos + _LEN.size <= len(data):
+            n, = _LEN.unpack_from(data, pos); pos += _LEN.size
+            if pos + n > len(data): break  # Cut short, by a crash
+            yield pickle.loads(data[pos:pos+n])
+            pos += n
+
+    def __contains__(self, mole) -> bool:
+        key = _key(mole)
+        return key is not None and mole in self._bucket(key)
+
+    def __iter__(self) -> Iterator[Mole]:
+        for name in os.listdir(self._dir()):
+            if name != _MARKER: self._bucket(tuple(name.split('.', 1)))
+        for bucket in list(self._buckets.values()):
+            for mole in bucket:
+                yield mole
+
+    def __len__(self) -> int:
+        return sum(1 for _ in self)
+
+    def add(self, mole: Mole):
+        key = _key(mole)
+        assert key is not None, 'Only finished molecules are legit'
+        bucket = self._bucket(key)
+        if mole in bucket: return
+        mole = mole.freeze()
+        bucket.add(mole)
+        try:
+            record = pickle.dumps(mole)
+        except (pickle.PicklingError, AttributeError, TypeError):
+            return  # Kept in memory only
+        self._pending.setdefault(key, []).append(_LEN.pack(len(record)) + record)
+        if sum(map(len, self._pending.values())) >= self.batch: self.flush()
+
+    def discard(self, mole: Mole):
+        """Only from memory: the files are append-only"""
+        key = _key(mole)
+        if key is not None: self._bucket(key).discard(mole)
+
+    def flush(self):
+        """Append the new molecules to their files"""
+        pending, self._pending = self._pending, {}
+        if not pending: return
+        for key, records in pending.items():
+            with open(os.path.join(self.path, self._fingerprint, '{}.{}'.format(*key)), 'ab') as f:
+                fcntl.flock(f, fcntl.LOCK_EX)
+                f.write(b''.join(records))
+                f.flush()
+
+    def clear(self):
+        """Forget the molecules loaded, the files are read again on demand"""
+        self.flush()
+        self._fingerprint, self._buckets = None, {}
+
+
+def _key(mole) -> Optional[Tuple[str, str]]:
+    """The (type, constructor) of a finished molecule, None for anything else"""
+    if type(mole) is not Mole: return None
+    types, cons = mole['_types'], mole['_cons']
+    if type(types) is not Atom or type(cons) is not Atom\
+            or not types.is_singleton() or not cons.is_singleton():
+        return None
+    return only(types), only(cons)
@@ -4,6 +4,7 @@ from khoa_math import *
 from type_data import *
 from rel import *
 from call_tree import *
+import roots
 
 import anytree
 import timeit
@@ -47,46 +48,7 @@ sys.excepthook = custom_traceback
 
 
 def main_func():
-    p = Mole(_types=wr('WFF'), _cons=wr('ATOM'), _text=wr('P'))
-    q = Mole(_types=wr('WFF'), _cons=wr('ATOM'), _text=wr('Q'))
-    r = Mole(_types=wr('WFF'), _cons=wr('ATOM'), _text=wr('R'))
-    pq = Mole(_types=wr('WFF'), _cons=wr('CONJUNCTION'), left_f=p, right_f=q)
-    qr = Mole(_types=wr('WFF'), _cons=wr('CONJUNCTION'), left_f=q, right_f=r)
-    pq_r = Mole(_types=wr('WFF'), _cons=wr('CONJUNCTION'), left_f=pq, right_f=r)
-
-    setup_vars, new_setup_vars = [p, q, r, pq, qr, pq_r], []
-    for i, sr in enumerate(setup_vars):
-        sr = list(kenum(State(node=sr, max_dep=10, orig=setup_node)))[0]
-        new_setup_vars.append(sr)
-        setup_node.log('{}. SETUP OUTPUT:'.format(i))
-        setup_node.log_m(sr)
-
-    p, q, r, pq, qr, pq_r = new_setup_vars
-
-    # Main roots
-    and_intro_root = Mole(_types = wr('PROOF'),
-                          dep    = wr(frozenset({p,q})),
-                          formu  = pq)
-    and_elim_root = Mole(_types = wr('PROOF'),  # Focus on this one
-                         dep    = wr(frozenset({pq})),
-                         formu  = p)
-    both_root = Mole(_types = wr('PROOF'),
-                     formu  = pq_r,
-                     dep    = wr(frozenset({qr, p})))
-
-    start_roots = [Mole(_types = wr('WFF_TEST')),  # Danger!
-                   Mole(_types = wr('UNI'),
-                        sub1   = Atom({frozenset({1,2}), frozenset({3})}),
-                        super  = Atom({frozenset({1,2,3}), frozenset({2,3,4})})),
-                   Mole(_types = wr('UNI'),
-                        sub0   = Atom({frozenset({6,3,4})}),
-                        sub1   = Atom({frozenset({1,2}), frozenset({3})})),
-                   Mole(_types = wr('ISO_TEST'), x = Atom({1,2,3})),
-                   Mole(_types = wr('ISO_TEST'), y = Atom({1,2,3})),
-                   Mole(_types = wr('MULTI'), y = Atom({1,2,3})),
-                   and_intro_root,
-                   and_elim_root,
-                   both_root]
+    start_roots = [root for _, root in roots.start_roots(setup_node)]
     start_time = timeit.default_timer()
     START_SLICE = 8
     STOP_SLICE  = 9
@@ -99,4 +61,5 @@ def main_func():
     stop_time = timeit.default_timer()
     info_node.log("Program Executed in {} seconds".format(stop_time - start_time))
 
-main_func()
+if __name__ == '__main__':
+    main_func()
@@ -1,7 +1,9 @@
 import logging, inspect
 from enum import Enum, auto
-from typing import Iterable
+from typing import Iterable, Union, Sequence, Callable, Tuple
 from itertools import *
+from collections import deque
+from heapq import heappush, heappop
 
 
 # Awesome class to name Enums
@@ -24,16 +26,222 @@ def nth(iterable, n, default=None):
     return next(islice(iterable, n, None), default)
 
 
+def interleave(branches: Iterable[Iterable], weights: Sequence[int] = ()):
+    """
+    Fair merge of iterables: every turn takes in the next branch (`branches`
+    may itself be lazy, even infinite), then up to `weights[i]` items (1 by
+    default) from each live branch i. So no branch can starve the others.
+    """
+    source, live, count = iter(branches), deque(), 0
+    while True:
+        if source is not None:
+            try:
+                branch = next(source)
+            except StopIteration:
+                source = None
+            else:
+                weight = weights[count] if count < len(weights) else 1
+                live.append((iter(branch), weight))
+                count += 1
+        if not live:
+            if source is None: return
+            else: continue
+        for _ in range(len(live)):
+            it, weight = live.popleft()
+            for _ in range(weight):
+                try:
+                    item = next(it)
+                except StopIteration:
+                    break
+                yield item
+            else:
+                live.append((it, weight))
+
+
+def dprod(*iterables):
+    """
+    Lazy, fair cartesian product: tuples come in diagonal (Cantor) order,
+    by the sum of their indices, so the first one is out after a single item
+    from each iterable. Items are pulled (and cached) only when a diagonal
+    needs them, so infinite iterables are fine.
+    """
+    its = [iter(it) for it in iterables]
+    n = len(its)
+    if n == 0:
+        yield ()
+        return
+    caches, done = [[] for _ in its], [False]*n
+
+    def fetch(i, k):
+        """Make sure that the k-th item of the i-th iterable is cached, if it exists"""
+        while len(caches[i]) <= k and not done[i]:
+            try: caches[i].append(next(its[i]))
+            except StopIteration: done[i] = True
+
+    def diagonal(level, i):
+        """All index suffixes from position i on, summing to `level`"""
+        if i == n-1:
+            if level < len(caches[i]): yield (level,)
+        else:
+            for k in range(min(level+1, len(caches[i]))):
+                for rest in diagonal(level-k, i+1):
+                    yield (k,) + rest
+
+    level = 0
+    while True:
+        for i in range(n): fetch(i, level)
+        if any(not cache for cache in caches): return
+        if all(done) and level > sum(len(cache)-1 for cache in caches): return
+        for indices in diagonal(level, 0):
+            yield tuple(caches[i][k] for i, k in enumerate(indices))
+        level += 1
+
+
+def cprod(*iterables, cost: Callable):
+    """
+    Like `dprod`, but tuples come by the total `cost` of their items, cheapest
+    first, provided each iterable comes cheapest first. Items are pulled only
+    when a tuple using them is next in line.
+    """
+    its = [iter(it) for it in iterables]
+    n = len(its)
+    if n == 0:
+        yield ()
+        return
+    caches, done = [[] for _ in its], [False]*n
+
+    def fetch(i, k):
+        """Make sure that the k-th item of the i-th iterable is cached, True if it exists"""
+        while len(caches[i]) <= k and not done[i]:
+            try: caches[i].append(next(its[i]))
+            except StopIteration: done[i] = True
+        return k < len(caches[i])
+
+    if not all(fetch(i, 0) for i in range(n)): return
+    first = (0,)*n
+    # Entries are (total, indices, step): `step` is the iterable whose last item
+    # hasn't been pulled yet, `total` is then a lower bound, using the item before
+    heap, seen = [(sum(cost(cache[0]) for cache in caches), first, None)], {first}
+    while heap:
+        total, indices, step = heappop(heap)
+        if step is not None:
+            k = indices[step]
+            if fetch(step, k):
+                heappush(heap, (total - cost(caches[step][k-1]) + cost(caches[step][k]), indices, None))
+            continue
+        yield tuple(caches[i][k] for i, k in enumerate(indices))
+        for i, k in enumerate(indices):
+            succ = indices[:i] + (k+1,) + indices[i+1:]
+            if succ in seen: continue
+            seen.add(succ)
+            if k+1 < len(caches[i]):
+                heappush(heap, (total - cost(caches[i][k]) + cost(caches[i][k+1]), succ, None))
+            elif not done[i]:
+                heappush(heap, (total, succ, i))
+
+
+def best_merge(streams: Iterable[Tuple[float, Iterable]], cost: Callable):
+    """
+    Merge `streams`, (bound, iterable) pairs, cheapest item first. Each iterable
+    must come cheapest first with no item below its bound, and the pairs must
+    come by bound (`streams` may be lazy, even infinite). The frontier holds
+    iterables (keyed on the cost of the item they gave last) and items pulled
+    from them, the cheapest entry is expanded until it's an item.
+    """
+    source, frontier, tie = iter(streams), [], count()
+    pending = next(source, None)
+    while True:
+        # The next stream could be cheaper than anything in the frontier
+        while pending is not None and (not frontier or pending[0] <= frontier[0][0]):
+            heappush(frontier, (pending[0], next(tie), None, iter(pending[1])))
+            pending = next(source, None)
+        if not frontier: return
+        key, _, item, it = heappop(frontier)
+        if it is None:
+            yield item
+            continue
+        try:
+            item = next(it)
+        except StopIteration:
+            continue
+        key = cost(item)
+        heappush(frontier, (key, next(tie), item, None))
+        heappush(frontier, (key, next(tie), None, it))
+
+
 def powerset(iterable):
     "powerset([1,2,3]) --> {} {1,} {2,} {3,} {1,2} {1,3} {2,3} {1,2,3} (frozenset)"
     s = list(iterable)
     return (frozenset(x) for x in chain.from_iterable(combinations(s, r) for r in range(len(s)+1)))
 
 
-def car(path: str): return path.split('/')[0]
+class Path(tuple):
+    """
+    A path parsed once into its tuple of roles.
+    Don't construct it directly, use `as_path` to get the interned one.
+    """
+    def __str__(self): return '/'.join(self)
+
+    def __repr__(self): return repr(str(self))
+
+
+_paths = {}
+
+def as_path(path: Union[str, tuple]) -> Path:
+    """Intern `path` (a string like 'conj_p/formu/left_f' or a tuple of roles)"""
+    if type(path) is Path: return path
+    res = _paths.get(path)
+    if res is None:
+        roles = (path.split('/') if path else ()) if type(path) is str else path
+        res = _paths.setdefault(tuple(roles), Path(roles))
+        _paths[path] = res
+    return res
+
+
+def car(path) -> str:
+    path = as_path(path)
+    return path[0] if path else ''
+
+def cdr(path) -> Path: return as_path(as_path(path)[1:])
+
+def rcar(path) -> str:
+    path = as_path(path)
+    return path[-1] if path else ''
+
+def rcdr(path) -> Path: return as_path(as_path(path)[:-1])
+
+
+if __name__ == '__main__':
+    # interleave: a new branch each turn, then an item from each live one
+    assert take(9, interleave([count(0), 'ab', iter('xyz')])) == [0, 1, 'a', 2, 'b', 'x', 3, 'y', 4]
+    assert list(interleave(['aaa', 'bbb'], [2])) == ['a', 'a', 'a', 'b', 'b', 'b']
+    # Infinitely many infinite branches, none of them starves
+    firsts = take(100, interleave(count(100*i) for i in count()))
+    assert all(100*i in firsts for i in range(10))
+    print('interleave: ok')
 
-def cdr(path: str): return '/'.join(path.split('/')[1:])
+    # dprod: the whole product, by diagonals (sum of the indices)
+    for lists in [([1, 2, 3], [10, 20], [100, 200, 300]), ([1], [2, 3, 4, 5]), ([], [1]), ()]:
+        got = list(dprod(*lists))
+        assert sorted(got) == sorted(product(*lists)) and len(set(got)) == len(got)
+        sums = [sum(l.index(x) for l, x in zip(lists, t)) for t in got]
+        assert sums == sorted(sums)
+    sums = [sum(t) for t in take(50, dprod(count(), count(), count()))]
+    assert sums == sorted(sums) and sums[0] == 0
+    print('dprod: ok')
 
-def rcar(path: str): return path.split('/')[-1]
+    # cprod: the whole product, cheapest first, also from infinite iterables
+    cost = lambda x: x
+    for lists in [([1, 2, 5], [0, 3, 4], [2, 2, 7]), ([3], [1, 1, 9]), ([], [1]), ()]:
+        got = list(cprod(*lists, cost=cost))
+        assert sorted(got) == sorted(product(*lists))
+        assert [sum(t) for t in got] == sorted(sum(t) for t in got)
+    totals = [sum(t) for t in take(60, cprod(count(), count(0, 2), cost=cost))]
+    assert totals == sorted(totals)
 
-def rcdr(path: str): return '/'.join(path.split('/')[:-1])
+    # best_merge: every item, cheapest first, with infinitely many streams
+    streams = [(0, [0, 4, 9]), (1, [1, 1, 8]), (3, [3, 5]), (7, [])]
+    assert list(best_merge(iter(streams), cost)) == sorted(x for _, s in streams for x in s)
+    got = take(40, best_merge(((i, count(i, i+1)) for i in count()), cost))
+    assert got == sorted(got) and got[:3] == [0, 1, 1]
+    print('cprod, best_merge: ok')
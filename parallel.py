@@ -0,0 +1,93 @@
+from kenum import *
+import glob
+
+from concurrent.futures import Future, ProcessPoolExecutor, as_completed
+import pickle
+
+
+def kenum_par(s: State, workers: Optional[int] = None, split_dep: Optional[int] = None):
+    """
+    Like `kenum`, but the constructor branches of `s.node` are explored by a
+    pool of `workers` processes. Answers arrive one task at a time: a worker
+    sends all the answers of its branch at once, and branches come back in
+    the order they complete.
+
+    With `split_dep`, a branch with at least that much depth left is split
+    further: its Relation phase runs here and the Finishing phase of each
+    partial molecule becomes a task of its own.
+
+    Workers start with a copy of `glob.legits`, the molecules they add to it
+    are merged back. Branches that cannot be pickled (e.g. an implicit atom
+    with an anonymous qualifier) are explored in this process, when their turn
+    comes, their answers interleaved with those of the workers.
+    """
+    if type(s.node) is Atom or not is_enumerable(s.node)\
+            or s.node.freeze() in glob.legits:
+        for res in kenum(s):
+            yield res
+        return
+
+    ex = ProcessPoolExecutor(max_workers=workers, initializer=_init_worker,
+                             initargs=(frozenset(glob.legits),))
+    try:
+        pending = {ex.submit(_remote, task, *args): (task, args)
+                   for task, args in _tasks(s, split_dep)}
+        for res in _collect(s, pending, as_completed(list(pending))):
+            yield res
+    finally:
+        ex.shutdown(wait=False, cancel_futures=True)
+
+
+def _collect(s: State, pending: Dict[Future, tuple], futures: Iterable[Future]) -> Iterator:
+    """
+    The answers of those of `futures` that are still `pending` (future ->
+    task), as they complete. A task that couldn't be pickled runs here, and
+    the workers that are done meanwhile are collected between its answers.
+    """
+    for future in futures:
+        if future not in pending: continue  # Collected meanwhile
+        task, args = pending.pop(future)
+        try:
+            answers, new_legits = future.result()
+        except (pickle.PicklingError, AttributeError, TypeError):
+            s.orig.log('Cannot send this branch away, exploring it here')
+            for res in task(*args):
+                yield res
+                for other in _collect(s, pending, [f for f in pending if f.done()]):
+                    yield other
+            continue
+        glob.legits |= new_legits
+        for res in answers:
+            yield res
+
+
+def _tasks(s: State, split_dep):
+    """Yield the (task, arguments) pairs that together cover `kenum(s)`"""
+    for well_formed in form_p(s.clone(orig=s.orig.sub())):
+        if split_dep is None or s.max_dep < split_dep:
+            yield (cons_p, (s.clone(), well_formed))
+        else:
+            compiled = grammar().cons[only(well_formed['_types'])][only(well_formed['_cons'])]
+            for partial_ in prop_p(s.clone(node=well_formed), compiled.rels, compiled.readers):
+                yield (_fin_task, (s.clone(node=partial_),))
+
+
+_start_legits = frozenset()
+
+def _init_worker(legits: FrozenSet[Mole]):
+    """Workers may not be forks, so they are given the legit molecules"""
+    global _start_legits
+    _start_legits, glob.legits = legits, set(legits)
+
+
+def _remote(task, *args):
+    """Run a task in a worker: all its answers, and the molecules it made legit"""
+    answers = list(task(*args))
+    return answers, glob.legits - _start_legits
+
+
+def _fin_task(s: State):
+    for finished in fin_p(s):
+        finished = finished.freeze()
+        glob.legits.add(finished)
+        yield finished
@@ -0,0 +1,251 @@
+"""
+Symbolic predicates, the qualifiers of implicit atoms.
+
+    conj(Tag('STR'), Tag('INT'))            # None: nothing is both
+    Tag('SET') & ~SetBounds(lo=1, hi=1)     # The sets that aren't singletons
+
+A predicate is a type tag (`Tag`), a set interval (`SetBounds`, SINGLETON is
+the interval of the sets of one value), the negation of one (`Not`), a plain
+function (`Opaque`) or a conjunction of those (`And`, `TRUE` is the empty
+one). `conj` builds conjunctions in normal form: flat, without duplicates or
+what the rest implies, and None when it can tell that nothing satisfies them,
+without trying any value. Predicates compare and hash by structure (functions
+by identity), and those without functions can be pickled.
+"""
+from bitset import *
+
+from typing import *
+from itertools import combinations
+from functools import reduce
+import pickle
+
+
+class Pred:
+    __slots__ = ()
+
+    def _key(self):
+        raise NotImplementedError
+
+    def __eq__(self, other):
+        return type(other) is type(self) and self._key() == other._key()
+
+    def __ne__(self, other):
+        return not self == other
+
+    def __hash__(self) -> int:
+        return hash((type(self).__name__, self._key()))
+
+    def __and__(self, other):
+        return conj(self, other)
+
+    def __invert__(self):
+        return negate(self)
+
+
+_TESTS = {'STR': lambda x: type(x) is str,
+          'INT': lambda x: type(x) is int,
+          'SET': is_set}
+
+
+class Tag(Pred):
+    """The values of one type, different tags have no value in common"""
+    __slots__ = ('name', 'test')
+
+    def __init__(self, name: str):
+        self.name, self.test = name, _TESTS[name]
+
+    def _key(self): return self.name
+    def __call__(self, x) -> bool: return self.test(x)
+    def __reduce__(self): return (Tag, (self.name,))
+    def __repr__(self) -> str: return self.name
+
+
+class Not(Pred):
+    __slots__ = ('pred',)
+
+    def __init__(self, pred):
+        self.pred = pred
+
+    def _key(self): return self.pred
+    def __call__(self, x) -> bool: return not self.pred(x)
+    def __reduce__(self): return (Not, (self.pred,))
+    def __repr__(self) -> str: return '~{}'.format(self.pred)
+
+
+class Opaque(Pred):
+    """A function, nothing is known about it"""
+    __slots__ = ('fun',)
+
+    def __init__(self, fun: Callable[..., bool]):
+        self.fun = fun
+
+    def _key(self): return self.fun
+    def __call__(self, x) -> bool: return self.fun(x)
+    def __repr__(self) -> str: return '?{}?'.format(self.fun)
+
+    def __reduce__(self):
+        raise pickle.PicklingError('Cannot pickle the anonymous qualifier {}'.format(self))
+
+
+class And(Pred):
+    """Build it with `conj`, which keeps it in normal form"""
+    __slots__ = ('preds', 'order')
+
+    def __init__(self, preds: FrozenSet = frozenset()):
+        self.preds = preds
+        self.order = sorted(preds, key=_rank)  # Cheap tests first
+
+    def _key(self): return self.preds
+    def __reduce__(self): return (And, (self.preds,))
+
+    def __call__(self, x) -> bool:
+        for pred in self.order:
+            if not pred(x): return False
+        return True
+
+    def __repr__(self) -> str:
+        return ' & '.join(sorted(map(repr, self.preds))) or 'ANY'
+
+
+class SetBounds(NamedTuple):
+    """
+    A set interval: the sets X with `lower` <= X <= `upper` (None for no upper
+    bound) and `lo` <= |X| <= `hi`. Intervals are narrowed by bound arithmetic,
+    their sets are only listed when asked for (`sets`).
+    Build the atoms with `bounded`.
+    """
+    lower: BitSet = BitSet()
+    upper: Optional[BitSet] = None
+    lo: int = 0
+    hi: Optional[int] = None
+
+    def __call__(self, x) -> bool:
+        return is_set(x) and self.lower <= x\
+               and (self.upper is None or x <= self.upper)\
+               and self.lo <= len(x) and (self.hi is None or len(x) <= self.hi)
+
+    def __and__(self, other):
+        if type(other) is not SetBounds: return conj(self, other)
+        return SetBounds(self.lower | other.lower, _meet(self.upper, other.upper, lambda x, y: x & y),
+                         max(self.lo, other.lo), _meet(self.hi, other.hi, min))
+
+    def __invert__(self):
+        return negate(self)
+
+    def tight(self) -> 'SetBounds':
+        """The same sets, with the cardinalities narrowed by the bounds"""
+        return SetBounds(self.lower, self.upper, max(self.lo, len(self.lower)),
+                         _meet(self.hi, None if self.upper is None else len(self.upper), min))
+
+    def within(self, other: 'SetBounds') -> bool:
+        """True if every set in this interval is in `other` too"""
+        return other.lower <= self.lower and self.lo >= other.lo\
+               and (other.upper is None or self.upper is not None and self.upper <= other.upper)\
+               and (other.hi is None or self.hi is not None and self.hi <= other.hi)
+
+    def is_empty(self) -> bool:
+        b = self.tight()
+        return b.upper is not None and not b.lower <= b.upper\
+               or b.hi is not None and b.lo > b.hi
+
+    def sets(self) -> Iterator[BitSet]:
+        """The sets in the interval, smallest first (needs an upper bound)"""
+        b, lower = self.tight(), BitSet(self.lower).mask
+        free = (BitSet(self.upper) - BitSet(self.lower)).bits()
+        for r in range(b.lo, b.hi + 1):
+            for x in combinations(free, r - len(b.lower)):
+                yield BitSet.of_mask(lower | sum(x))
+
+    def __repr__(self) -> str:
+        res = '{} <= X'.format(set(self.lower) or '{}')
+        if self.upper is not None: res += ' <= {}'.format(set(self.upper) or '{}')
+        if self.lo > 0 or self.hi is not None:
+            res += ', |X| in {}..{}'.format(self.lo, '' if self.hi is None else self.hi)
+        return res
+
+
+def _meet(x, y, meet):
+    """`meet` of two bounds, None standing for no bound"""
+    return y if x is None else x if y is None else meet(x, y)
+
+
+PREDS = (Tag, Not, Opaque, And, SetBounds)
+_RANKS = {Tag: 0, SetBounds: 1, Not: 2, And: 3, Opaque: 4}
+
+
+def _rank(pred) -> int:
+    return _RANKS[type(pred)]
+
+
+TRUE = And()
+
+
+def negate(pred):
+    return pred.pred if type(pred) is Not else Not(pred)
+
+
+def conj(*preds) -> Optional[Pred]:
+    """The conjunction of `preds` in normal form, None if nothing satisfies it"""
+    flat = set()
+    for pred in preds:
+        if pred is None: return None
+        flat.update(pred.preds if type(pred) is And else (pred,))
+
+    tags = {p.name for p in flat if type(p) is Tag}
+    intervals = [p for p in flat if type(p) is SetBounds]
+    bounds = None
+    if intervals:
+        bounds = reduce(SetBounds.__and__, intervals).tight()
+        if bounds.is_empty(): return None
+        tags.add('SET')
+    if len(tags) > 1: return None
+
+    res = {p for p in flat if type(p) in (Opaque, Not)}
+    if bounds is not None and bounds != SetBounds(): res.add(bounds)
+    elif tags: res.add(Tag(next(iter(tags))))
+    for p in [p for p in res if type(p) is Not]:
+        neg = p.pred
+        if neg == TRUE or neg in res: return None
+        elif type(neg) is Tag and tags:
+            if neg.name in tags: return None
+            res.discard(p)  # Another type already
+        elif type(neg) is SetBounds and tags:
+            if bounds is not None and bounds.within(neg): return None
+            elif 'SET' not in tags: res.discard(p)
+
+    if len(res) == 1: return res.pop()
+    return And(frozenset(res))
+
+
+if __name__ == '__main__':
+    import random
+    rnd = random.Random(0)
+    elems = [1, 2, 3]
+    subsets = [BitSet(s) for r in range(4) for s in combinations(elems, r)]
+    universe = ['a', 'bc', 0, 1, 7] + subsets
+
+    def some_pred(depth=0):
+        kind = rnd.randrange(5 if depth < 2 else 3)
+        if kind == 0: return Tag(rnd.choice(['STR', 'INT', 'SET']))
+        elif kind == 1:
+            lower = rnd.choice(subsets)
+            upper = rnd.choice([None] + [s for s in subsets if lower <= s])
+            lo = rnd.randrange(3)
+            return SetBounds(lower, upper, lo, rnd.choice([None, lo, lo + 1, lo + 2]))
+        elif kind == 2:
+            allowed = frozenset(rnd.sample(range(len(universe)), 6))
+            return Opaque(lambda x, allowed=allowed: universe.index(x) in allowed)
+        elif kind == 3: return ~some_pred(depth + 1)
+        else: return conj(*(some_pred(depth + 1) for _ in range(2))) or TRUE
+
+    for _ in range(5000):
+        preds = [some_pred() for _ in range(rnd.randrange(1, 5))]
+        truth = [all(p(x) for p in preds) for x in universe]
+        res = conj(*preds)
+        if res is None:
+            assert not any(truth), preds  # None only if nothing satisfies them
+        else:
+            assert [bool(res(x)) for x in universe] == truth, (preds, res)
+            assert conj(res) == res == conj(res, res) and hash(conj(res)) == hash(res)
+            assert [bool((~res)(x)) for x in universe] == [not t for t in truth]
+    print('conj: ok')
@@ -1,4 +1,4 @@
-from misc import MyEnum
+from misc import MyEnum, Path, as_path
 from typing import *
 from khoa_math import wr, only
 
@@ -6,20 +6,45 @@ from khoa_math import wr, only
 # Basic relation types:
 # FUN: (fun inp out)
 # UNION: (subs sup)
+# EQ: (left right), the two paths are aliases (see `Mole.alias`)
 
 
 class Rel(dict):
     def __init__(self, type_: str, **kwargs):
         self.type = type_
+        # Paths are parsed once, here
+        for key in ['inp', 'subs']:
+            if key in kwargs: kwargs[key] = [as_path(p) for p in kwargs[key]]
+        for key in ['out', 'sup', 'left', 'right']:
+            if key in kwargs: kwargs[key] = as_path(kwargs[key])
         super().__init__(**kwargs)
 
     def __repr__(self) -> str:
         if self.type == 'FUN':
-            return '{} -> {}'.format(' '.join(self['inp']), self['out'])
+            return '{} -> {}'.format(' '.join(map(str, self['inp'])), self['out'])
         elif self.type == 'UNION':
-            return '(U {}) = {}'.format(' '.join(self['subs']), self['sup'])
+            return '(U {}) = {}'.format(' '.join(map(str, self['subs'])), self['sup'])
         elif self.type == 'ISO':
             return '{} <-> {}'.format(self['left'], self['right'])
+        elif self.type == 'EQ':
+            return '{} = {}'.format(self['left'], self['right'])
+
+    def reads(self) -> List[Path]:
+        """
+        The paths this relation takes information from. Inputs are enumerated
+        by their roles, so it's the roles that count.
+        """
+        if self.type == 'FUN': return [as_path(p[:1]) for p in self['inp']]
+        elif self.type == 'UNION': return [as_path(p[:1]) for p in self['subs'] + [self['sup']]]
+        else: return []
+
+    def writes(self) -> List[Path]:
+        """The paths this relation may narrow (inputs are enumerated by their roles)"""
+        if self.type == 'FUN':
+            return [as_path(p[:1]) for p in self['inp']] + [self['out']]
+        elif self.type == 'UNION':
+            return [as_path(p[:1]) for p in self['subs'] + [self['sup']]]
+        else: return []
 
 
 def funo(fun, inp, out):
@@ -32,8 +57,8 @@ def iso(lr_fun, rl_fun, left, right):
 
 
 def eq(left, right):
-    iden = lambda x: x
-    return iso(lr_fun=iden, rl_fun=iden, left=left, right=right)
+    """Not fired like the others: the two paths share their value from the formation on"""
+    return (Rel(type_='EQ', left=left, right=right),)
 
 
 def adapter(fun: Callable):
@@ -53,5 +78,4 @@ def kiso(lr_fun, rl_fun, left, right):
 
 
 def keq(left, right):
-    iden = adapter(lambda x: x)
-    return iso(lr_fun=iden, rl_fun=iden, left=left, right=right)
+    return eq(left, right)  # Atoms are shared like the rest
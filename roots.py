@@ -0,0 +1,59 @@
+from kenum import *
+from khoa_math import *
+from call_tree import *
+
+
+def setup(orig: LogNode = None) -> Dict[str, Mole]:
+    """The legit formulas the proof roots are built from"""
+    if orig is None: orig = NULL
+    p = Mole(_types=wr('WFF'), _cons=wr('ATOM'), _text=wr('P'))
+    q = Mole(_types=wr('WFF'), _cons=wr('ATOM'), _text=wr('Q'))
+    r = Mole(_types=wr('WFF'), _cons=wr('ATOM'), _text=wr('R'))
+    pq = Mole(_types=wr('WFF'), _cons=wr('CONJUNCTION'), left_f=p, right_f=q)
+    qr = Mole(_types=wr('WFF'), _cons=wr('CONJUNCTION'), left_f=q, right_f=r)
+    pq_r = Mole(_types=wr('WFF'), _cons=wr('CONJUNCTION'), left_f=pq, right_f=r)
+
+    res = {}
+    for i, (name, sr) in enumerate(zip(['p', 'q', 'r', 'pq', 'qr', 'pq_r'],
+                                       [p, q, r, pq, qr, pq_r])):
+        sr = next(kenum(State(node=sr, max_dep=10, orig=orig)))
+        res[name] = sr
+        orig.log('{}. SETUP OUTPUT:', i)
+        orig.log_m(sr)
+    return res
+
+
+def start_roots(orig: LogNode = None) -> List[Tuple[str, Mole]]:
+    """The canonical roots, by name"""
+    f = setup(orig)
+    return [('wff_test',  Mole(_types = wr('WFF_TEST'))),  # Danger!
+            ('uni_super', Mole(_types = wr('UNI'),
+                               sub1   = Atom({frozenset({1,2}), frozenset({3})}),
+                               super  = Atom({frozenset({1,2,3}), frozenset({2,3,4})}))),
+            ('uni_sub0',  Mole(_types = wr('UNI'),
+                               sub0   = Atom({frozenset({6,3,4})}),
+                               sub1   = Atom({frozenset({1,2}), frozenset({3})}))),
+            ('iso_x',     Mole(_types = wr('ISO_TEST'), x = Atom({1,2,3}))),
+            ('iso_y',     Mole(_types = wr('ISO_TEST'), y = Atom({1,2,3}))),
+            ('multi',     Mole(_types = wr('MULTI'), y = Atom({1,2,3}))),
+            ('and_intro', Mole(_types = wr('PROOF'),
+                               dep    = wr(frozenset({f['p'], f['q']})),
+                               formu  = f['pq'])),
+            ('and_elim',  Mole(_types = wr('PROOF'),  # Focus on this one
+                               dep    = wr(frozenset({f['pq']})),
+                               formu  = f['p'])),
+            ('both',      Mole(_types = wr('PROOF'),
+                               formu  = f['pq_r'],
+                               dep    = wr(frozenset({f['qr'], f['p']}))))]
+
+
+# Depths worth benchmarking for each root
+depths = {'wff_test':  [2, 3],
+          'uni_super': [2, 3],
+          'uni_sub0':  [2, 3],
+          'iso_x':     [2, 3],
+          'iso_y':     [2, 3],
+          'multi':     [2, 3],
+          'and_intro': [3, 4, 5],
+          'and_elim':  [3, 4, 5],
+          'both':      [4, 5, 6]}
@@ -0,0 +1,76 @@
+from khoa_math import Mole
+
+from typing import *
+from collections import Counter
+import time
+
+
+class Stats:
+    """
+    Counters and timers for kenum, cheap enough to stay on.
+
+    Phases (e.g. 'form_p', 'rel_p/FUN') and constructors ((type, cons) pairs)
+    are counted by `timed`, which also measures the time spent in them.
+    A phase gets its self time (not counting the timed phases it calls), so the
+    phase times add up. A constructor gets the self time of the phases run for
+    it, but not of those run for the constructors of its sub-goals.
+    Everything else (unifications, prunes, errors...) is an event, see `count`.
+    """
+    def __init__(self):
+        self.timing = True   # False: count calls, but don't time them
+        self.report, self.period, self._due = None, None, None
+        self.reset()
+
+    def reset(self):
+        self.calls, self.times, self.events = Counter(), Counter(), Counter()
+        self._stack = []               # [child time, constructor] of the timed generators running
+        self._clones = Mole.clones     # Clones made before the reset
+
+    def count(self, event: str, n: int = 1):
+        self.events[event] += n
+
+    def timed(self, key: Hashable, gen: Iterable) -> Iterator:
+        """Count a call of `key`, and time `gen` while it runs"""
+        self.calls[key] += 1
+        if not self.timing: return gen
+        return self._timed(key, iter(gen))
+
+    def _timed(self, key, it):
+        times, stack, clock = self.times, self._stack, time.perf_counter
+        owner = key if type(key) is tuple else None
+        while True:
+            if owner is None and stack: owner = stack[-1][1]
+            frame = [0.0, owner]
+            stack.append(frame)
+            start = clock()
+            try:
+                val = next(it)
+            except StopIteration:
+                return
+            finally:
+                elapsed = clock() - start
+                stack.pop()
+                times[key] += elapsed - frame[0]
+                if owner is not None and owner is not key: times[owner] += elapsed - frame[0]
+                if stack: stack[-1][0] += elapsed
+            yield val
+
+    def every(self, period: Optional[float], report: Callable[[Dict], Any] = print):
+        """Pass a snapshot to `report` every `period` seconds (None to stop)"""
+        self.period, self.report = period, (None if period is None else report)
+        self._due = None if period is None else time.perf_counter() + period
+
+    def tick(self):
+        """Called by kenum on every call, reports if it's time"""
+        if self.report is not None and time.perf_counter() >= self._due:
+            self._due = time.perf_counter() + self.period
+            self.report(self.snapshot())
+
+    def snapshot(self) -> Dict[str, Dict]:
+        phases = {k: {'calls': n, 'time': self.times[k]}
+                  for k, n in self.calls.items() if type(k) is str}
+        cons = {'{}/{}'.format(*k): {'calls': n, 'time': self.times[k]}
+                for k, n in self.calls.items() if type(k) is tuple}
+        events = dict(self.events)
+        events['clone'] = Mole.clones - self._clones
+        return {'phases': phases, 'cons': cons, 'events': events}
@@ -0,0 +1,193 @@
+from typing import *
+from collections import OrderedDict
+
+
+class Entry:
+    """The answers recorded for one call, plus the generator still producing them"""
+    def __init__(self, producer: Iterator):
+        self.answers, self.producer = [], producer
+        self.error = None    # The exception that ended the production, if any
+        self.busy = False    # True while the producer is running
+        self.tabled = True   # False once evicted
+        self.cutoff = False  # True if a limit (depth, time) cut the production short
+        self.timed_out = False  # True if a timeout did, then it's dropped once done
+        self.settle = None   # (family, depth) to record once complete, see `AnswerTable.settled`
+
+
+class AnswerTable:
+    """
+    Tabling for generators: the first call with a key starts the producer,
+    every call (including those arriving while the producer is still running)
+    replays the recorded answers, and pulls new ones only when it runs out.
+
+    `max_size` bounds the number of entries plus recorded answers, least
+    recently used entries are evicted first. Consumers of an evicted entry
+    keep going, only new callers start over.
+
+    Exceptions are recorded and re-raised to later callers, except for those
+    marked `transient` (e.g. timeouts), which also drop the entry.
+    A producer that calls for its own key while it is running (directly or
+    further down) would be waiting on itself: that raises a `RuntimeError`
+    instead of returning a truncated stream. `kenum` can't do it, its calls
+    all have less depth than their caller.
+
+    A producer that is cut short by a limit calls `cutoff`, which marks it and
+    every entry whose production is waiting on it (those on the `running`
+    stack), and entries replaying a marked one get marked too. An entry that
+    completes unmarked is `settled` for its family (e.g. the same node at any
+    depth), at its depth: a call of the family with a larger limit would find
+    the very same answers. A producer that swallows a timeout calls `timeout`
+    instead, marking the entries the same way: their answers depend on the
+    clock, so they are dropped once complete, and the next callers start over.
+    """
+    def __init__(self, max_size: int = 100000):
+        self.max_size = max_size
+        self.entries, self.size = OrderedDict(), 0
+        self.hits, self.misses = 0, 0
+        self.running = []  # Entries whose producer is running, innermost last
+        self.settled = {}  # Family -> (depth, key) of the shallowest settled entry
+
+    def cutoff(self):
+        for entry in self.running:
+            entry.cutoff = True
+
+    def timeout(self):
+        for entry in self.running:
+            entry.cutoff = entry.timed_out = True
+
+    def consume(self, key: Hashable, start: Callable[[], Iterator],
+                settle: Tuple[Hashable, int] = None) -> Iterator:
+        entry = self.entries.get(key)
+        if entry is None:
+            self.misses += 1
+            entry = Entry(start())
+            entry.settle = settle
+            self.entries[key] = entry
+            self.size += 1
+            self._evict()
+        else:
+            self.hits += 1
+            self.entries.move_to_end(key)
+        return self._replay(key, entry)
+
+    def _replay(self, key, entry: Entry):
+        i = 0
+        while True:
+            if entry.timed_out: self.timeout()  # What we're feeding on is cut short
+            elif entry.cutoff: self.cutoff()
+            if i < len(entry.answers):
+                yield entry.answers[i]
+                i += 1
+            elif entry.producer is None:
+                if entry.error is not None: raise entry.error
+                return
+            elif entry.busy:
+                raise RuntimeError('Recursive call on a table entry being filled: {}'.format(key))
+            else:
+                entry.busy = True
+                self.running.append(entry)
+                try:
+                    answer = next(entry.producer)
+                except StopIteration:
+                    entry.producer = None
+                    if entry.timed_out: self._drop(key, entry)
+                    else: self._settle(key, entry)
+                except Exception as e:
+                    entry.producer, entry.error = None, e  # For the other replayers too
+                    if getattr(e, 'transient', False): self._drop(key, entry)
+                    raise
+                else:
+                    entry.answers.append(answer)
+                    if entry.tabled:
+                        self.size += 1
+                        self._evict()
+                finally:
+                    entry.busy = False
+                    self.running.pop()
+
+    def _settle(self, key, entry: Entry):
+        if entry.cutoff or entry.settle is None or not entry.tabled: return
+        family, depth = entry.settle
+        old = self.settled.get(family)
+        if old is None or depth < old[0]: self.settled[family] = (depth, key)
+
+    def _drop(self, key, entry: Entry):
+        if entry.tabled:
+            entry.tabled = False
+            self.size -= 1 + len(entry.answers)
+            del self.entries[key]
+            if entry.settle is not None and self.settled.get(entry.settle[0], (None, None))[1] == key:
+                del self.settled[entry.settle[0]]
+
+    def _evict(self):
+        while self.size > self.max_size and self.entries:
+            key, entry = next(iter(self.entries.items()))
+            self._drop(key, entry)
+
+    def clear(self):
+        for key, entry in list(self.entries.items()):
+            self._drop(key, entry)
+
+
+if __name__ == '__main__':
+    table, starts = AnswerTable(), []
+
+    def producer(name, n, action=None):
+        starts.append(name)
+        for i in range(n):
+            if i == 1 and action: action()
+            yield (name, i)
+
+    # Callers share one producer, even one arriving halfway
+    first = table.consume('k', lambda: producer('k', 3), ('k', 1))
+    assert next(first) == ('k', 0)
+    second = table.consume('k', None)
+    assert list(second) == [('k', 0), ('k', 1), ('k', 2)] and list(first) == [('k', 1), ('k', 2)]
+    assert starts == ['k'] and table.settled['k'] == (1, 'k')
+    list(table.consume('k2', lambda: producer('k2', 1), ('k', 0)))
+    assert table.settled['k'] == (0, 'k2')
+
+    # A cut entry isn't settled, and neither is one replaying it
+    list(table.consume('cut', lambda: producer('cut', 3, table.cutoff), ('cut', 1)))
+    list(table.consume('outer', lambda: table.consume('cut', None), ('outer', 1)))
+    assert 'cut' not in table.settled and 'outer' not in table.settled
+    assert table.entries['cut'].cutoff and table.entries['outer'].cutoff
+
+    # Nor is one waiting on a timed out one, both are dropped once done and the next call starts over
+    def waiting():
+        yield from table.consume('slow', lambda: producer('slow', 3, table.timeout))
+    list(table.consume('waiting', waiting, ('waiting', 1)))
+    assert 'slow' not in table.entries and 'waiting' not in table.entries and 'waiting' not in table.settled
+    list(table.consume('slow', lambda: producer('slow', 2)))
+    assert starts.count('slow') == 2 and 'slow' in table.entries
+
+    # Errors are replayed, transient ones to every replayer, and then forgotten
+    class Transient(Exception): transient = True
+    def failing(error):
+        yield 0
+        raise error
+    for error, kept in [(ValueError('bad'), True), (Transient(), False)]:
+        a = table.consume(type(error), lambda: failing(error))
+        b = table.consume(type(error), None)
+        assert next(a) == next(b) == 0
+        for it in [a, b]:
+            try: list(it); assert False
+            except type(error): pass
+        assert (type(error) in table.entries) == kept
+    try: list(table.consume(ValueError, None)); assert False
+    except ValueError: pass
+
+    # A producer waiting on itself
+    def recursive():
+        yield from table.consume('self', None)
+    try: list(table.consume('self', recursive)); assert False
+    except RuntimeError: pass
+
+    # Least recently used entries go first, only new callers start over
+    small = AnswerTable(max_size=10)
+    for key in range(4): list(small.consume(key, lambda key=key: producer(key, 2)))
+    assert list(small.entries) == [1, 2, 3] and small.size == 9
+    list(small.consume(1, None))
+    list(small.consume(0, lambda: producer(0, 2)))
+    assert starts.count(0) == 2 and list(small.entries) == [3, 1, 0]
+    print('AnswerTable: ok')
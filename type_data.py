@@ -2,12 +2,50 @@ from khoa_math import *
 from rel import *
 
 from typing import *
+from functools import lru_cache
 
 
 #---------------Stuff to interface with the typing modules------------
 class CI(NamedTuple):         # Constructor item
     form: Mole                # The model of the constructor
     rels: Iterable[Rel] = []  # The relations between different parts
+    goal: Optional[Callable[[Mole], Iterable[Mole]]] = None
+    # Goal-directed search (`State.directed`): narrows a well-formed node down
+    # to the nodes worth trying, which must cover the answers that matter
+
+
+#---------------------------GOAL HOOKS---------------------------
+@lru_cache(maxsize=1000)
+def conjunctions(premises: FrozenSet[Mole]) -> Tuple[Mole, ...]:
+    """The conjunctions among the subformulas of `premises`, smallest first"""
+    res, todo = set(), list(premises)
+    while todo:
+        formula = todo.pop()
+        if formula['_cons'] == wr('CONJUNCTION'): res.add(formula)
+        todo.extend(val for val in formula.values() if type(val) is Mole)
+    return tuple(sorted(res, key=lambda f: (f.complexity, repr(f))))
+
+
+def eliminate(side: str):
+    """
+    The goal of &E1 (`side` is 'left_f') and &E2 ('right_f'): the conjunction
+    to eliminate is one of the premises' (in `dep`) whose `side` can be the
+    formula to prove. Normal proofs have the subformula property, so they are
+    all still there, only detours (like eliminating what &I just built) aren't.
+    """
+    def goal(node: Mole) -> Iterator[Mole]:
+        dep = node['dep']
+        bounds = as_bounds(dep) if type(dep) is Atom else None
+        if bounds is None or bounds.upper is None:
+            yield node  # Nothing to go by
+            return
+        premises = frozenset(bounds.upper)
+        for conj in conjunctions(premises):
+            if (node['formu'] & conj[side]).is_inconsistent(): continue
+            res = node.clone()
+            res['conj_p/formu'] &= conj
+            if not res.is_inconsistent(): yield res
+    return goal
 
 
 #----------------------------DICTIONARY----------------------------
@@ -56,7 +94,8 @@ cons_dic['PROOF']['&E1'] = CI(
             *eq('conj_p/dep', 'dep'),
             kfun(fun = lambda x: '(&E1 {})'.format(x),
                  inp = ['conj_p/_text'],
-                 out = '_text')])
+                 out = '_text')],
+    goal = eliminate('left_f'))
 
 cons_dic['PROOF']['&E2'] = CI(
     form = Mole(formu  = Mole(_types = wr('WFF')),
@@ -68,7 +107,8 @@ cons_dic['PROOF']['&E2'] = CI(
             *eq('conj_p/dep', 'dep'),
             kfun(fun = lambda x: '(&E2 {})'.format(x),
                  inp = ['conj_p/_text'],
-                 out = '_text')])
+                 out = '_text')],
+    goal = eliminate('right_f'))
 
 cons_dic['PROOF']['&I'] = CI(
     form = Mole(formu   = Mole(_types = wr('WFF'), _cons = wr('CONJUNCTION')),